@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.middleware.QueryCountMiddleware',  # first, to count the queries of every other middleware too
+    'shop.middleware.DatabaseRoutingMiddleware',  # primary or replica reads (see shop/routers.py)
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +54,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# X-Query-Count and X-Query-Time-Ms response headers, always sent in DEBUG
+QUERY_COUNT_HEADERS = False
+
 ROOT_URLCONF = 'project.urls'
 
 TEMPLATES = [
@@ -80,6 +85,29 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Seconds a connection is kept for the next requests of the worker, with its SQLite profile
+        'CONN_MAX_AGE': 60,
+    },
+    # Read replica of the catalog. Locally a copy of the primary stands in for it, made by the sync_replica command
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db-replica.sqlite3',
+        'CONN_MAX_AGE': 60,
+        # The tests read the replica from the primary test database
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['shop.routers.PrimaryReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Use a persistent backend (FileBasedCache, DatabaseCache...) to keep cached values across restarts
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -128,13 +156,80 @@ STATIC_URL = '/static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Pagination
+# The public catalog viewsets also accept ?pagination=cursor for keyset pagination (see shop/pagination.py)
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',  # or LimitOffsetPagination
     'PAGE_SIZE': 10,
-    'DEFAULT_AUTHENTICATION_CLASSES': ('rest_framework_simplejwt.authentication.JWTAuthentication',)
+    # JWTAuthentication with the user lookup cached (see shop/authentication.py)
+    'DEFAULT_AUTHENTICATION_CLASSES': ('shop.authentication.CachedJWTAuthentication',)
 }
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
-}
\ No newline at end of file
+}
+
+# OpenFoodFacts ecoscore cache (see shop/ecoscore.py)
+ECOSCORE = {
+    'URL': 'https://world.openfoodfacts.org/api/v0/product/{barcode}.json',
+    'CACHE_ALIAS': 'default',
+    'CACHE_TIMEOUT': 60 * 60 * 24,  # seconds a known ecoscore is kept
+    'NEGATIVE_CACHE_TIMEOUT': 60 * 5,  # seconds a failed lookup is remembered
+    'LRU_MAXSIZE': 1024,  # entries kept in process memory
+    'LRU_TIMEOUT': 60 * 5,
+    'MAX_WORKERS': 8,  # concurrent lookups when resolving a batch of products
+    'PAGE_TIMEOUT': 2,  # seconds a batch waits for its missing ecoscores
+    'REFRESH_MAX_AGE': 60 * 60 * 24,  # seconds before refresh_ecoscores considers a stored ecoscore stale
+}
+
+# HTTP client used for the external APIs (see shop/clients.py)
+EXTERNAL_API = {
+    'POOL_CONNECTIONS': 10,  # number of hosts kept in the connection pool
+    'POOL_MAXSIZE': 10,  # connections kept per host
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 5,
+    'RETRIES': 2,  # retries of idempotent calls, with exponential backoff
+    'BACKOFF_FACTOR': 0.3,
+    'FAILURE_THRESHOLD': 5,  # consecutive failures opening the circuit
+    'RESET_TIMEOUT': 30,  # seconds before a trial call is let through an open circuit
+}
+
+# Banned words of the category names (see shop/moderation.py)
+MODERATION = {
+    'BANNED_WORDS_FILE': BASE_DIR / 'shop' / 'banned_words.txt',  # one word per line, reloaded when it changes
+    'CHECK_INTERVAL': 5,  # seconds between two checks of the modification time of the file
+}
+
+# Users of the JWT authenticated requests (see shop/authentication.py)
+AUTH_USER_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 60,  # seconds, saving or deleting a user invalidates it right away
+    'KEY_PREFIX': 'auth-user',
+}
+
+# Server side cache of the read-only catalog responses (see shop/cache.py)
+RESPONSE_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 60 * 5,
+    'KEY_PREFIX': 'response',
+}
+
+# Read/write routing of the catalog viewsets (see shop/routers.py)
+DATABASE_ROUTING = {
+    'REPLICAS': [],  # aliases of DATABASES read by the catalog viewsets, e.g. ['replica'] after sync_replica
+    'STICKY_SECONDS': 5,  # seconds a user reads from the primary after a write, longer than the replication lag
+    'STICKY_APPS': ['shop'],  # apps whose writes make the user read from the primary, not the sessions or tokens
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'db-primary',
+}
+
+# Pragmas set on every SQLite connection and health checks of the persistent connections (see shop/database.py)
+SQLITE_PROFILE = {
+    'ENABLED': True,
+    'JOURNAL_MODE': 'wal',  # readers and the writer no longer block each other
+    'SYNCHRONOUS': 'normal',  # safe with WAL, no flush to the disk on every commit
+    'CACHE_SIZE': -64000,  # KiB of page cache per connection
+    'MMAP_SIZE': 128 * 1024 * 1024,  # bytes read through memory mapping
+    'BUSY_TIMEOUT': 5000,  # milliseconds waited for a lock before 'database is locked'
+    'HEALTH_CHECKS': True,  # check the reused connections at the start of each request
+}
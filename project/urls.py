@@ -6,7 +6,9 @@ from django.urls import path, include
 # from shop.views import ProductList
 from rest_framework import routers
 from shop.views import CategoryViewset, ProductViewset, ArticleViewset, \
-    AdminCategoryViewset, AdminArticleViewset #transform ApiView & ListAPIView into a ModelViewset
+    AdminCategoryViewset, AdminArticleViewset, ExternalAPIMetricsView, \
+    ResponseCacheMetricsView, CatalogExportView, SearchView, async_category_list, async_product_list, \
+    async_article_list  #transform ApiView & ListAPIView into a ModelViewset
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 # Here we create our router
@@ -24,6 +26,14 @@ urlpatterns = [
     path('api-auth/', include('rest_framework.urls')),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/admin/external-api/', ExternalAPIMetricsView.as_view(), name='external-api-metrics'),
+    path('api/admin/response-cache/', ResponseCacheMetricsView.as_view(), name='response-cache-metrics'),
+    path('api/export/', CatalogExportView.as_view(), name='catalog-export'),
+    path('api/search/', SearchView.as_view(), name='search'),
+    # Async versions of the catalog lists, served concurrently under ASGI (see project/asgi.py)
+    path('api/async/category/', async_category_list, name='async-category-list'),
+    path('api/async/product/', async_product_list, name='async-product-list'),
+    path('api/async/article/', async_article_list, name='async-article-list'),
     path('api/', include(router.urls)),  # Remember to add the router URLs to the list of URLs
     # path('api/category/', CategoryAPIView.as_view()),
     # path('api/product/', ProductList.as_view(), name='product_list'),  # For the class-based view with generic views
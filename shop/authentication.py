@@ -0,0 +1,75 @@
+"""
+JWT authentication resolving the user from the cache instead of the database.
+
+The user loaded for a token is cached under its id and a version token of the user, like the response cache tags:
+saving or deleting the user (signals in shop/signals.py) gives it a new version, so the requests that follow load
+it from the database again. A version read before loading the user also keeps a request that raced with a save
+from caching the previous state of the user under the new version.
+
+Only the fields the permissions read are cached (``CACHED_FIELDS``), never the password hash or the personal data:
+the user of a cached request is rebuilt from them, unsaved, and must not be saved.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+CACHED_FIELDS = ('pk', 'is_active', 'is_staff', 'is_superuser')
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 60,
+    'KEY_PREFIX': 'auth-user',
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'AUTH_USER_CACHE', {}).get(name, DEFAULTS[name])
+
+
+class UserCache:
+
+    @property
+    def backend(self):
+        return caches[get_setting('CACHE_ALIAS')]
+
+    def version_key(self, user_id):
+        return f"{get_setting('KEY_PREFIX')}:version:{user_id}"
+
+    def get_version(self, user_id):
+        key = self.version_key(user_id)
+        version = self.backend.get(key)
+        if version is None:
+            self.backend.add(key, uuid.uuid4().hex, None)
+            version = self.backend.get(key)
+        return version
+
+    def make_key(self, user_id, version):
+        return f"{get_setting('KEY_PREFIX')}:{user_id}:{version}"
+
+    def invalidate(self, user_id):
+        self.backend.set(self.version_key(user_id), uuid.uuid4().hex, None)
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication whose user lookup is cached for AUTH_USER_CACHE['TIMEOUT'] seconds"""
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            # Let the parent class raise its error
+            return super().get_user(validated_token)
+
+        key = user_cache.make_key(user_id, user_cache.get_version(user_id))
+        fields = user_cache.backend.get(key)
+        if fields is not None:
+            return self.user_model(**fields)
+        # Raises AuthenticationFailed for unknown and inactive users, which are not cached
+        user = super().get_user(validated_token)
+        user_cache.backend.set(key, {name: getattr(user, name) for name in CACHED_FIELDS}, get_setting('TIMEOUT'))
+        return user
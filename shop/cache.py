@@ -0,0 +1,86 @@
+"""
+Server side cache of the read-only catalog responses, backed by the Django cache framework.
+
+Each cached response depends on tags (``'product'`` for the product list, ``'product:12'`` for a product detail...).
+Every tag has a version token stored in the cache and the token of each tag is part of the key of the responses
+depending on it: invalidating a tag gives it a new token, so only the responses depending on it are missed
+afterwards. No key enumeration is needed, which keeps it working with the local-memory and file backends.
+
+Inside a transaction the tags are only invalidated once it commits: a request reading in between would otherwise
+cache the previous rows under the new tokens, and keep serving them until they expire.
+"""
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 60 * 5,
+    'KEY_PREFIX': 'response',
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'RESPONSE_CACHE', {}).get(name, DEFAULTS[name])
+
+
+class ResponseCache:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        return caches[get_setting('CACHE_ALIAS')]
+
+    def tag_key(self, tag):
+        return f"{get_setting('KEY_PREFIX')}:tag:{tag}"
+
+    def get_versions(self, tags):
+        keys = [self.tag_key(tag) for tag in tags]
+        versions = self.backend.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                # A tag seen for the first time (or evicted) gets a fresh token, never a previous one
+                self.backend.add(key, uuid.uuid4().hex, None)
+                versions[key] = self.backend.get(key)
+        return [versions[key] for key in keys]
+
+    def make_key(self, scope, url, tags):
+        # The absolute url: the bodies hold absolute links (pagination), which depend on the host and the scheme
+        raw = '|'.join([scope, url, *self.get_versions(tags)])
+        return f"{get_setting('KEY_PREFIX')}:{hashlib.md5(raw.encode()).hexdigest()}"
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, get_setting('TIMEOUT'))
+
+    def invalidate(self, *tags):
+        # Run right away outside of a transaction
+        transaction.on_commit(lambda: self.backend.set_many({self.tag_key(tag): uuid.uuid4().hex for tag in tags},
+                                                            None))
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+response_cache = ResponseCache()
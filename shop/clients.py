@@ -0,0 +1,243 @@
+"""
+Shared HTTP client for the external APIs (OpenFoodFacts).
+
+Each process keeps one pooled ``requests.Session`` so that connections are reused between calls.
+Every call is bounded by connect/read timeouts, idempotent calls are retried with backoff, and a circuit breaker
+fails fast while the upstream is unhealthy instead of tying up a worker on each request.
+``SingleFlight`` lets concurrent callers asking for the same resource share a single in-flight request.
+"""
+import os
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULTS = {
+    'POOL_CONNECTIONS': 10,
+    'POOL_MAXSIZE': 10,
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 5,
+    'RETRIES': 2,
+    'BACKOFF_FACTOR': 0.3,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'EXTERNAL_API', {}).get(name, DEFAULTS[name])
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling the upstream while the circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures. While open, calls are rejected
+    until ``reset_timeout`` seconds have passed, then a single trial call is let through (half open):
+    its success closes the circuit, its failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    # Returned by allow() for the trial call, which must end the trial once done
+    TRIAL = 'trial'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """Return False when the call is rejected, TRIAL for the trial call of the half open circuit, True otherwise"""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return self.TRIAL
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        # The trial is ended by its own call (end_trial): a call admitted before the circuit opened may fail
+        # while the trial is running
+        with self._lock:
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def end_trial(self):
+        with self._lock:
+            self.trial_running = False
+
+    def reset(self):
+        self.record_success()
+
+
+class HTTPClient:
+    """Pooled, timeout bounded HTTP client guarded by a circuit breaker."""
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, connect_timeout=None, read_timeout=None,
+                 retries=None, backoff_factor=None, failure_threshold=None, reset_timeout=None):
+
+        def option(value, name):
+            return get_setting(name) if value is None else value
+
+        self.pool_connections = option(pool_connections, 'POOL_CONNECTIONS')
+        self.pool_maxsize = option(pool_maxsize, 'POOL_MAXSIZE')
+        self.timeout = (option(connect_timeout, 'CONNECT_TIMEOUT'), option(read_timeout, 'READ_TIMEOUT'))
+        self.retries = option(retries, 'RETRIES')
+        self.backoff_factor = option(backoff_factor, 'BACKOFF_FACTOR')
+        self.breaker = CircuitBreaker(option(failure_threshold, 'FAILURE_THRESHOLD'),
+                                      option(reset_timeout, 'RESET_TIMEOUT'))
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+        self._stats = self.empty_stats()
+
+    @staticmethod
+    def empty_stats():
+        return {'calls': 0, 'failures': 0, 'rejected': 0, 'total_latency': 0.0, 'last_latency': None}
+
+    @property
+    def session(self):
+        # Sessions must not be shared with forked worker processes, each process builds its own
+        with self._lock:
+            if self._session is None or self._session_pid != os.getpid():
+                self._session = self.build_session()
+                self._session_pid = os.getpid()
+            return self._session
+
+    def build_session(self):
+        retry = Retry(total=self.retries, backoff_factor=self.backoff_factor,
+                      status_forcelist=(502, 503, 504), allowed_methods=frozenset(['GET', 'HEAD']),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, method, url, **kwargs):
+        admitted = self.breaker.allow()
+        if not admitted:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise CircuitOpenError(f'Circuit open, {url} is not called')
+
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.monotonic()
+        try:
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException:
+                self.record_call(start, failed=True)
+                raise
+            # Server errors mean the upstream is unhealthy, client errors do not
+            self.record_call(start, failed=response.status_code >= 500)
+            return response
+        finally:
+            # Whatever the call raised, the half open circuit must not wait for this trial forever. Only the trial
+            # call ends it, the calls admitted while the circuit was closed may finish during another trial
+            if admitted == CircuitBreaker.TRIAL:
+                self.breaker.end_trial()
+
+    def record_call(self, start, failed):
+        latency = time.monotonic() - start
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['total_latency'] += latency
+            self._stats['last_latency'] = latency
+            if failed:
+                self._stats['failures'] += 1
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        calls = stats['calls']
+        stats['average_latency'] = stats['total_latency'] / calls if calls else None
+        stats['state'] = self.breaker.state
+        return stats
+
+    def reset(self):
+        """Close the circuit and reset the metrics."""
+        self.breaker.reset()
+        with self._lock:
+            self._stats = self.empty_stats()
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls sharing the same key: the first caller runs the function,
+    the other ones wait for it and get the same result (or the same exception).
+    """
+
+    class Call:
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, function, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self.Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+openfoodfacts_client = HTTPClient()
+openfoodfacts_flight = SingleFlight()
@@ -0,0 +1,66 @@
+"""
+Connection profile of the SQLite databases, for serving concurrent requests from several workers.
+
+The pragmas of ``SQLITE_PROFILE`` are set on every new SQLite connection (signal in shop/signals.py):
+
+- ``journal_mode = WAL``: readers no longer block the writer and the writer no longer blocks the readers.
+  The mode is stored in the database file, the ``-wal`` and ``-shm`` files appear next to it.
+- ``synchronous = NORMAL``: safe with WAL, the commits are no longer flushed to the disk one by one,
+  only the checkpoints are (a power loss may lose the last commits, not corrupt the database).
+- ``cache_size``: pages kept in memory per connection, in KiB when negative.
+- ``mmap_size``: bytes of the file read through memory mapping instead of read() calls.
+- ``busy_timeout``: milliseconds a connection waits for the lock held by another one before failing with
+  'database is locked'.
+
+They are executed on the raw sqlite3 connection, so that they are not counted as queries of the request.
+With ``CONN_MAX_AGE`` in DATABASES the connections, and their profile, are kept from one request to the next;
+``HEALTH_CHECKS`` then checks at the start of each request that a reused connection still works, and closes it
+otherwise so that the request opens a new one, as Django 4.1 does with CONN_HEALTH_CHECKS.
+"""
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': True,
+    'JOURNAL_MODE': 'wal',
+    'SYNCHRONOUS': 'normal',
+    'CACHE_SIZE': -64000,
+    'MMAP_SIZE': 128 * 1024 * 1024,
+    'BUSY_TIMEOUT': 5000,
+    'HEALTH_CHECKS': True,
+}
+
+PRAGMAS = ('JOURNAL_MODE', 'SYNCHRONOUS', 'CACHE_SIZE', 'MMAP_SIZE', 'BUSY_TIMEOUT')
+
+
+def get_setting(name):
+    return getattr(settings, 'SQLITE_PROFILE', {}).get(name, DEFAULTS[name])
+
+
+def get_pragmas():
+    """Return the pragmas of the profile as (name, value), an empty list when it is disabled"""
+    if not get_setting('ENABLED'):
+        return []
+    return [(name.lower(), get_setting(name)) for name in PRAGMAS if get_setting(name) is not None]
+
+
+def apply_pragmas(sqlite_connection, pragmas):
+    """Set the ``pragmas`` on a sqlite3 connection and return their values read back"""
+    values = {}
+    for name, value in pragmas:
+        # Pragmas take no parameters, the values come from the settings
+        sqlite_connection.execute(f'PRAGMA {name} = {value}')
+        row = sqlite_connection.execute(f'PRAGMA {name}').fetchone()
+        # None when the pragma does not apply, e.g. mmap_size for an in-memory database
+        values[name] = row[0] if row is not None else None
+    return values
+
+
+def check_connection(connection):
+    """Close the persistent ``connection`` when it no longer works, the next query opens a new one"""
+    if connection.connection is None or connection.in_atomic_block:
+        return
+    # is_usable() is always true for SQLite, whose failure is a transaction left open by a previous request:
+    # it would hold the lock of the database file and the other workers would fail with 'database is locked'
+    leaked_transaction = connection.vendor == 'sqlite' and connection.connection.in_transaction
+    if leaked_transaction or not connection.is_usable():
+        connection.close()
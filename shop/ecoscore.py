@@ -0,0 +1,224 @@
+"""
+Cache layer in front of the OpenFoodFacts ecoscore lookups.
+
+Reading ``Product.ecoscore`` used to trigger one outbound HTTP call per product. Lookups now go through a
+two-level cache keyed by barcode: a small in-process LRU (with its own TTL) in front of a Django cache backend,
+which is shared between processes and survives restarts when a persistent backend (file, database) is configured.
+Failed lookups are cached too, with a shorter timeout, so that an unhealthy upstream is not hammered.
+
+``resolve_ecoscores`` resolves a whole batch of products at once: the missing barcodes are fetched concurrently
+on a bounded thread pool, and the batch waits at most ``PAGE_TIMEOUT`` seconds for them.
+``aresolve_ecoscores`` does the same for the async views, awaiting the lookups without blocking the event loop.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+
+OPENFOODFACTS_URL = 'https://world.openfoodfacts.org/api/v0/product/{barcode}.json'
+
+DEFAULTS = {
+    'URL': OPENFOODFACTS_URL,
+    'CACHE_ALIAS': 'default',
+    'CACHE_TIMEOUT': 60 * 60 * 24,
+    'NEGATIVE_CACHE_TIMEOUT': 60 * 5,
+    'LRU_MAXSIZE': 1024,
+    'LRU_TIMEOUT': 60 * 5,
+    'MAX_WORKERS': 8,
+    'PAGE_TIMEOUT': 2,
+    'REFRESH_MAX_AGE': 60 * 60 * 24,
+}
+
+# Marker stored for failed lookups, so that "cached failure" can be told apart from "not cached"
+MISSING = '__missing__'
+NOT_CACHED = object()
+
+
+def get_setting(name):
+    return getattr(settings, 'ECOSCORE', {}).get(name, DEFAULTS[name])
+
+
+class LRUCache:
+    """Thread safe in-process LRU cache whose entries expire after ``timeout`` seconds."""
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                return default
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        with self._lock:
+            self._data[key] = (time.monotonic() + timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class EcoscoreCache:
+    """Ecoscore grades per barcode, in memory first then in the configured Django cache backend."""
+
+    key_prefix = 'ecoscore'
+
+    def __init__(self):
+        self.local = LRUCache(get_setting('LRU_MAXSIZE'), get_setting('LRU_TIMEOUT'))
+
+    @property
+    def backend(self):
+        return caches[get_setting('CACHE_ALIAS')]
+
+    def make_key(self, barcode):
+        return f'{self.key_prefix}:{barcode}'
+
+    def get(self, barcode, default=None):
+        """Return the cached grade, ``None`` for a cached failure or ``default`` when nothing is cached."""
+        key = self.make_key(barcode)
+        value = self.local.get(key)
+        if value is None:
+            value = self.backend.get(key)
+            if value is None:
+                return default
+            self.local.set(key, value)
+        return None if value == MISSING else value
+
+    def set(self, barcode, grade):
+        key = self.make_key(barcode)
+        if grade is None:
+            # Negative caching: remember the failure for a shorter time
+            value, timeout = MISSING, get_setting('NEGATIVE_CACHE_TIMEOUT')
+        else:
+            value, timeout = grade, get_setting('CACHE_TIMEOUT')
+        self.backend.set(key, value, timeout)
+        self.local.set(key, value, timeout)
+
+    def get_or_fetch(self, barcode, fetch):
+        """Return the cached grade for ``barcode``, calling ``fetch()`` and caching its result on a miss."""
+        grade = self.get(barcode, default=NOT_CACHED)
+        if grade is not NOT_CACHED:
+            return grade
+        return self.fetch(barcode, fetch)
+
+    def fetch(self, barcode, fetch):
+        """Call ``fetch()`` whatever is cached for ``barcode``, cache its result and return it."""
+        try:
+            grade = fetch()
+        except (requests.RequestException, ValueError, KeyError, TypeError):
+            # Network errors and unexpected payloads are cached as a missing ecoscore
+            grade = None
+        self.set(barcode, grade)
+        return grade
+
+    def invalidate(self, barcode):
+        key = self.make_key(barcode)
+        self.local.delete(key)
+        self.backend.delete(key)
+
+    def clear(self):
+        """Drop the in-process entries. Backend entries expire on their own or through ``invalidate``."""
+        self.local.clear()
+
+
+ecoscore_cache = EcoscoreCache()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Thread pool shared by every request of the process, created on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_setting('MAX_WORKERS'),
+                                           thread_name_prefix='ecoscore')
+        return _executor
+
+
+def resolve_ecoscores(products, timeout=None, refresh=False):
+    """
+    Return a dict mapping the barcode of each product to its ecoscore.
+    Cached barcodes are answered directly, the other ones are fetched concurrently.
+    With ``refresh`` every barcode is fetched, the cache is only written.
+    Barcodes that are still pending after ``timeout`` seconds are reported as ``None``,
+    their fetch keeps running in the background and fills the cache for the next requests.
+    """
+    ecoscores = {}
+    to_fetch = {}
+    for product in products:
+        if product.barcode in ecoscores or product.barcode in to_fetch:
+            continue
+        grade = NOT_CACHED if refresh else ecoscore_cache.get(product.barcode, default=NOT_CACHED)
+        if grade is NOT_CACHED:
+            to_fetch[product.barcode] = product
+        else:
+            ecoscores[product.barcode] = grade
+    if not to_fetch:
+        return ecoscores
+
+    executor = get_executor()
+    fetch = ecoscore_cache.fetch if refresh else ecoscore_cache.get_or_fetch
+    futures = {
+        executor.submit(fetch, barcode, product.fetch_ecoscore): barcode
+        for barcode, product in to_fetch.items()
+    }
+    done, not_done = wait(futures, timeout=timeout)
+    for future in done:
+        ecoscores[futures[future]] = future.result()
+    for future in not_done:
+        ecoscores[futures[future]] = None
+    return ecoscores
+
+
+async def aresolve_ecoscores(products, timeout=None):
+    """
+    Async version of ``resolve_ecoscores`` for the async views: the lookups run in the shared thread pool,
+    the HTTP client being synchronous, and are awaited together so that the event loop keeps serving
+    other requests meanwhile. Barcodes still pending after ``timeout`` seconds are reported as ``None``.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    futures = {}
+    barcodes = set()
+    for product in products:
+        if product.barcode not in barcodes:
+            barcodes.add(product.barcode)
+            # Cached barcodes are answered right away by get_or_fetch, from the pool to keep the loop free
+            future = loop.run_in_executor(executor, ecoscore_cache.get_or_fetch, product.barcode,
+                                          product.fetch_ecoscore)
+            futures[future] = product.barcode
+    if not futures:
+        return {}
+
+    done, not_done = await asyncio.wait(futures, timeout=timeout)
+    ecoscores = {futures[future]: future.result() for future in done}
+    for future in not_done:
+        # The fetch keeps running in the pool and fills the cache for the next requests
+        ecoscores[futures[future]] = None
+    return ecoscores
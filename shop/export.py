@@ -0,0 +1,116 @@
+"""
+Streaming export of the active catalog, for the downstream systems (search indexers, marketplaces).
+
+The categories, then the products, then the articles are read with ``values()`` and ``iterator(chunk_size)``:
+rows are fetched from the database cursor chunk by chunk and written as soon as they are read, so the memory
+used does not depend on the size of the catalog. Each record carries the id and the name of its parents to rebuild
+the tree, the names being the natural keys read by the import_catalog command.
+
+A full export only holds the active catalog. An incremental export (``updated_since``) holds every row changed
+since then, the inactive ones included with ``active`` false, so that the downstream systems remove what was
+disabled. Deleted rows leave nothing to export: an incremental export cannot carry the removals, the catalog is
+expected to disable rows rather than delete them, and a full export resynchronises the downstream systems.
+"""
+import csv
+from datetime import datetime, time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from shop.models import Category, Product, Article
+
+FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+FIELDS = ['type', 'id', 'category_id', 'category', 'product_id', 'product', 'name', 'description', 'price', 'active',
+          'date_updated']
+CHUNK_SIZE = 2000
+
+
+def parse_updated_since(value):
+    """Parse an ISO 8601 date or date time, a naive value is taken in the current time zone.
+    Return None when the value is not a valid date."""
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            if date is None:
+                return None
+            parsed = datetime.combine(date, time.min)
+    except ValueError:
+        return None
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def get_querysets(updated_since=None):
+    """
+    Return the (type, queryset of values) of the active catalog, a child is only exported with its parents.
+    With ``updated_since``, return the rows changed since then, active or not.
+    """
+    if updated_since is None:
+        categories = Category.objects.filter(active=True)
+        products = Product.objects.filter(active=True, category__active=True)
+        articles = Article.objects.filter(active=True, product__active=True, product__category__active=True)
+    else:
+        # Incremental export, served by the date_updated indexes
+        categories = Category.objects.filter(date_updated__gte=updated_since)
+        products = Product.objects.filter(date_updated__gte=updated_since)
+        articles = Article.objects.filter(date_updated__gte=updated_since)
+    querysets = [
+        ('category', categories.values('id', 'name', 'description', 'active', 'date_updated')),
+        ('product', products.values('id', 'category_id', 'category__name', 'name', 'description', 'active',
+                                    'date_updated')),
+        ('article', articles.values('id', 'product__category__name', 'product_id', 'product__name', 'name',
+                                    'description', 'price', 'active', 'date_updated')),
+    ]
+    return [(kind, queryset.order_by('id')) for kind, queryset in querysets]
+
+
+def iter_records(updated_since=None, chunk_size=CHUNK_SIZE):
+    for kind, queryset in get_querysets(updated_since):
+        for row in queryset.iterator(chunk_size=chunk_size):
+            row['type'] = kind
+            # The names of the parents are joined by the query, the natural keys of the importer
+            if 'category__name' in row:
+                row['category'] = row.pop('category__name')
+            if 'product__name' in row:
+                row['category'] = row.pop('product__category__name')
+                row['product'] = row.pop('product__name')
+            yield row
+
+
+def iter_ndjson(records):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for record in records:
+        yield encoder.encode(record) + '\n'
+
+
+class Echo:
+    """File-like object whose write() returns the line instead of buffering it, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(records):
+    writer = csv.DictWriter(Echo(), fieldnames=FIELDS)
+    yield writer.writeheader()
+    for record in records:
+        if record['date_updated'] is not None:
+            record['date_updated'] = record['date_updated'].isoformat()
+        yield writer.writerow(record)
+
+
+def export_catalog(export_format='ndjson', updated_since=None, chunk_size=CHUNK_SIZE):
+    """Return an iterator over the lines of the export"""
+    if export_format not in FORMATS:
+        raise ValueError(f'Unknown export format {export_format!r}, expected one of {", ".join(FORMATS)}')
+    records = iter_records(updated_since, chunk_size)
+    if export_format == 'csv':
+        return iter_csv(records)
+    return iter_ndjson(records)
@@ -0,0 +1,253 @@
+"""
+Batched import of catalog files (JSON lines or CSV), upserting the rows by natural key.
+
+Each record has a ``type`` ('category', 'product' or 'article') and is identified by its name and the names of its
+parents: ``{"type": "article", "category": "Fruit", "product": "Banane", "name": "Unité", "price": "2.50"}``.
+The other columns (description, active, price, barcode) are optional, missing ones are left as is on existing rows.
+The files written by the export_catalog command can be imported as is.
+
+The file is read line by line and the records are grouped in batches: for each batch, the parents and the existing
+rows are loaded with one query per model, then the new rows are written with bulk_create and the changed ones with
+bulk_update. Parents must appear before, or in the same batch as, their children. The counters of the parents of
+the written rows are refreshed at the end of each batch.
+"""
+import csv
+import json
+import os
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from shop.cache import response_cache
+from shop.models import Category, Product, Article, refresh_category_counters, refresh_product_counters
+
+FORMATS = ('jsonl', 'csv')
+BATCH_SIZE = 1000
+# Written in this order, so that the parents of a batch exist before its children
+MODELS = {
+    'category': Category,
+    'product': Product,
+    'article': Article,
+}
+# Natural key of each type, the name comes last
+KEYS = {
+    'category': ['name'],
+    'product': ['category', 'name'],
+    'article': ['category', 'product', 'name'],
+}
+COLUMNS = {
+    'category': ['description', 'active'],
+    'product': ['description', 'active', 'barcode'],
+    'article': ['description', 'active', 'price'],
+}
+REQUIRED_ON_CREATE = {
+    'article': ['price'],
+}
+PARENT_FIELDS = {
+    'product': 'category_id',
+    'article': 'product_id',
+}
+BOOLEANS = {'true': True, 'yes': True, '1': True, 'false': False, 'no': False, '0': False}
+CACHE_TAGS = ['category', 'category:bulk', 'product', 'product:bulk', 'article', 'article:bulk']
+
+
+class CatalogImportError(ValueError):
+
+    def __init__(self, line, message):
+        self.line = line
+        super().__init__(f'line {line}: {message}')
+
+
+def read_jsonl(file):
+    for line, text in enumerate(file, start=1):
+        if not text.strip():
+            continue
+        try:
+            yield line, json.loads(text)
+        except ValueError as error:
+            raise CatalogImportError(line, f'invalid JSON ({error})')
+
+
+def read_csv(file):
+    reader = csv.DictReader(file)
+    for record in reader:
+        # An empty cell is a missing value
+        yield reader.line_num, {key: value for key, value in record.items() if key is not None and value != ''}
+
+
+def read_file(file, file_format):
+    if file_format not in FORMATS:
+        raise ValueError(f'Unknown import format {file_format!r}, expected one of {", ".join(FORMATS)}')
+    return read_csv(file) if file_format == 'csv' else read_jsonl(file)
+
+
+def guess_format(path):
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    return 'jsonl' if extension in ('json', 'ndjson') else extension
+
+
+def clean_record(line, record):
+    """Return the type, the natural key and the cleaned column values of a record"""
+    if not isinstance(record, dict):
+        raise CatalogImportError(line, 'expected an object')
+    kind = record.get('type')
+    if kind not in MODELS:
+        raise CatalogImportError(line, f'unknown type {kind!r}')
+    key = []
+    for name in KEYS[kind]:
+        if not record.get(name):
+            raise CatalogImportError(line, f'{name} is required')
+        key.append(str(record[name]))
+
+    model = MODELS[kind]
+    values = {}
+    for column in COLUMNS[kind]:
+        if record.get(column) is None:
+            continue
+        field = model._meta.get_field(column)
+        value = record[column]
+        if isinstance(field, models.BooleanField) and isinstance(value, str):
+            # CSV cells are strings, written in lower case by most tools
+            value = BOOLEANS.get(value.strip().lower(), value)
+        try:
+            # Converts and validates the value as the model field would (max digits...)
+            values[column] = field.clean(value, None)
+        except ValidationError as error:
+            raise CatalogImportError(line, f'{column}: {" ".join(error.messages)}')
+    return kind, tuple(key), values
+
+
+class CatalogImporter:
+    """Upsert the records of a stream of (line number, record) in batches of ``batch_size`` rows per model"""
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        # natural key -> (line number, values), the last record wins when a key appears twice in a batch
+        self.batches = {kind: {} for kind in MODELS}
+        self.counts = {kind: {'created': 0, 'updated': 0} for kind in MODELS}
+        # ids of the parents whose children were written in the current batch, per parent type
+        self.touched = {'category': set(), 'product': set()}
+        self.rows = 0
+        self.duration = 0
+
+    def run(self, records):
+        start = time.perf_counter()
+        try:
+            for line, record in records:
+                kind, key, values = clean_record(line, record)
+                batch = self.batches[kind]
+                if key in batch:
+                    batch[key][1].update(values)
+                else:
+                    batch[key] = (line, values)
+                self.rows += 1
+                if len(batch) >= self.batch_size:
+                    self.flush()
+            self.flush()
+        finally:
+            self.duration += time.perf_counter() - start
+            # bulk_create and bulk_update send no signal
+            if any(count['created'] or count['updated'] for count in self.counts.values()):
+                response_cache.invalidate(*CACHE_TAGS)
+        return self.counts
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.duration if self.duration else 0
+
+    def flush(self):
+        if not any(self.batches.values()):
+            return
+        with transaction.atomic():
+            for kind, batch in self.batches.items():
+                if batch:
+                    self.upsert(kind, batch)
+                    batch.clear()
+            if self.touched['product']:
+                refresh_product_counters(self.touched['product'])
+            if self.touched['category']:
+                refresh_category_counters(self.touched['category'])
+        self.touched = {'category': set(), 'product': set()}
+
+    def get_parent_ids(self, kind, keys):
+        """Return the id of the parents of the natural ``keys`` (without the name of the row itself)"""
+        if kind == 'product':
+            queryset = Category.objects.filter(name__in={category for category, in keys})
+            # The category names are unique
+            rows = queryset.values_list('name', 'id')
+            return {(name,): pk for name, pk in rows}
+        queryset = Product.objects.filter(category__name__in={category for category, product in keys},
+                                          name__in={product for category, product in keys})
+        # Unlike the categories, the products and articles have no unique name: with duplicated names the oldest
+        # row wins, it is the last one
+        rows = queryset.order_by('-id').values_list('category__name', 'name', 'id')
+        return {(category, name): pk for category, name, pk in rows}
+
+    def upsert(self, kind, batch):
+        model = MODELS[kind]
+        parent_field = PARENT_FIELDS.get(kind)
+
+        # Natural keys are resolved to (parent id, name)
+        rows = {}
+        if parent_field is None:
+            for key, item in batch.items():
+                rows[(None, key[-1])] = item
+        else:
+            parent_ids = self.get_parent_ids(kind, {key[:-1] for key in batch})
+            for key, (line, values) in batch.items():
+                if key[:-1] not in parent_ids:
+                    raise CatalogImportError(line, f'unknown {KEYS[kind][-2]} {" / ".join(key[:-1])!r}')
+                rows[(parent_ids[key[:-1]], key[-1])] = (line, values)
+
+        queryset = model.objects.filter(name__in={name for parent_id, name in rows})
+        if parent_field is not None:
+            queryset = queryset.filter(**{f'{parent_field}__in': {parent_id for parent_id, name in rows}})
+        existing = {}
+        # Same for the duplicated products and articles updated, the oldest row is the last one
+        for obj in queryset.order_by('-id'):
+            existing[(getattr(obj, parent_field) if parent_field else None, obj.name)] = obj
+
+        now = timezone.now()
+        to_create, to_update, updated_fields = [], [], set()
+        for (parent_id, name), (line, values) in rows.items():
+            obj = existing.get((parent_id, name))
+            if obj is None:
+                for column in REQUIRED_ON_CREATE.get(kind, []):
+                    if column not in values:
+                        raise CatalogImportError(line, f'{column} is required to create a {kind}')
+                obj = model(name=name, **values)
+                if parent_field is not None:
+                    setattr(obj, parent_field, parent_id)
+                to_create.append(obj)
+                continue
+            changed = [column for column, value in values.items() if getattr(obj, column) != value]
+            if changed:
+                for column in changed:
+                    setattr(obj, column, values[column])
+                # bulk_update skips auto_now
+                obj.date_updated = now
+                updated_fields.update(changed)
+                to_update.append(obj)
+
+        if parent_field is not None:
+            parent_kind = KEYS[kind][-2]
+            self.touched[parent_kind].update(getattr(obj, parent_field) for obj in to_create + to_update)
+        model.objects.bulk_create(to_create, batch_size=self.batch_size)
+        if to_update:
+            model.objects.bulk_update(to_update, [*sorted(updated_fields), 'date_updated'],
+                                      batch_size=self.batch_size)
+        self.counts[kind]['created'] += len(to_create)
+        self.counts[kind]['updated'] += len(to_update)
+
+
+def delete_catalog():
+    """
+    Delete every article, product and category with a single DELETE statement per table, children first.
+    ``QuerySet.delete()`` would load the related rows in Python to cascade and send the delete signals.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in (Article, Product, Category):
+            cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+    response_cache.invalidate(*CACHE_TAGS)
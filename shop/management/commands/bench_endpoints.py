@@ -0,0 +1,218 @@
+import json
+import platform
+import statistics
+import time
+from contextlib import ExitStack
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from shop.cache import response_cache
+from shop.importer import CACHE_TAGS
+from shop.models import Category, Product, Article
+from shop.synthetic import create_catalog
+
+# URL names that are not benchmarked: the Django admin, the browsable API login and the endpoints writing to the
+# catalog, whose second call would not do the same work as the first one
+SKIPPED = {'login', 'logout', 'category-disable', 'category-enable', 'product-disable',
+           'admin-category-activation', 'admin-article-bulk'}
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'queries')
+
+
+class Command(BaseCommand):
+
+    help = 'Measure the latency, the queries and the throughput of every API endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help='Measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5, help='Requests per endpoint before measuring')
+        parser.add_argument('--cold', action='store_true', help='Invalidate the response cache before each request')
+        parser.add_argument('--endpoints', nargs='+', metavar='URL_NAME', help='Only benchmark these endpoints')
+        parser.add_argument('--categories', type=int, default=0,
+                            help='Generate a synthetic catalog of this many categories, rolled back at the end')
+        parser.add_argument('--products', type=int, default=100, help='Products per generated category')
+        parser.add_argument('--articles', type=int, default=5, help='Articles per generated product')
+        parser.add_argument('--output', help='JSON file the results are written to')
+        parser.add_argument('--compare', help='JSON file of a previous run to compare the results with')
+        parser.add_argument('--max-regression', type=float, metavar='PERCENT',
+                            help='Fail when the p95 of an endpoint grew by more than this percentage '
+                                 'or when it issues more queries than in the compared run')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        if options['requests'] < 2:
+            raise CommandError('--requests must be at least 2 to compute percentiles')
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                baseline = json.load(file)
+
+        # The synthetic catalog and the benchmark user are rolled back at the end
+        with transaction.atomic():
+            if options['categories']:
+                create_catalog(options['categories'], options['products'], options['articles'], seed=0)
+                response_cache.invalidate(*CACHE_TAGS)
+            endpoints = self.get_endpoints()
+            if options['endpoints']:
+                unknown = set(options['endpoints']) - set(endpoints)
+                if unknown:
+                    raise CommandError(f'Unknown endpoints: {", ".join(sorted(unknown))}')
+                endpoints = {name: endpoints[name] for name in options['endpoints']}
+
+            results = {
+                'date': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'requests': options['requests'],
+                'cold': options['cold'],
+                'catalog': {'categories': Category.objects.count(), 'products': Product.objects.count(),
+                            'articles': Article.objects.count()},
+                'endpoints': {},
+            }
+            self.stdout.write(', '.join(f'{count} {name}' for name, count in results['catalog'].items()))
+            for name, endpoint in endpoints.items():
+                results['endpoints'][name] = result = self.bench(endpoint, options)
+                self.stdout.write(f"{name:<24} {result['status']} p50 {result['p50_ms']:8.2f}ms "
+                                  f"p95 {result['p95_ms']:8.2f}ms p99 {result['p99_ms']:8.2f}ms "
+                                  f"{result['queries']:5.1f} queries {result['throughput_rps']:8.1f} req/s")
+            transaction.set_rollback(True)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            regressions = self.compare(baseline, results, options['max_regression'])
+            if regressions:
+                raise CommandError(f'Regression on {", ".join(regressions)}')
+        self.stdout.write(self.style.SUCCESS("All Done !"))
+
+    def get_endpoints(self):
+        """Return the benchmarked requests per URL name, fail when a route of project/urls.py is not covered"""
+        user = get_user_model().objects.create_superuser(
+            'benchmark', 'benchmark@shop.test', 'benchmark', is_staff=True)
+        category_id = Category.objects.filter(active=True).order_by('id').values_list('id', flat=True).first()
+        product_id = Product.objects.filter(active=True).order_by('id').values_list('id', flat=True).first()
+        article_id = Article.objects.filter(active=True).order_by('id').values_list('id', flat=True).first()
+        if None in (category_id, product_id, article_id):
+            raise CommandError('The catalog needs an active article, run generate_catalog or use --categories')
+        refresh = str(RefreshToken.for_user(user))
+
+        # name: (method, url, data, authenticated user)
+        endpoints = {
+            'category-list': ('get', reverse('category-list'), None, None),
+            'category-detail': ('get', reverse('category-detail', args=[category_id]), None, None),
+            'product-list': ('get', reverse('product-list'), None, None),
+            'product-list-category': ('get', f"{reverse('product-list')}?category_id={category_id}", None, None),
+            'product-detail': ('get', reverse('product-detail', args=[product_id]), None, None),
+            'article-list': ('get', reverse('article-list'), None, None),
+            'article-list-product': ('get', f"{reverse('article-list')}?product_id={product_id}", None, None),
+            'article-detail': ('get', reverse('article-detail', args=[article_id]), None, None),
+            'async-category-list': ('get', reverse('async-category-list'), None, None),
+            'async-product-list': ('get', reverse('async-product-list'), None, None),
+            'async-article-list': ('get', reverse('async-article-list'), None, None),
+            'admin-category-list': ('get', reverse('admin-category-list'), None, user),
+            'admin-category-detail': ('get', reverse('admin-category-detail', args=[category_id]), None, user),
+            'admin-article-list': ('get', reverse('admin-article-list'), None, user),
+            'admin-article-detail': ('get', reverse('admin-article-detail', args=[article_id]), None, user),
+            'search': ('get', f"{reverse('search')}?q=product", None, None),
+            'catalog-export': ('get', reverse('catalog-export'), None, user),
+            'external-api-metrics': ('get', reverse('external-api-metrics'), None, user),
+            'response-cache-metrics': ('get', reverse('response-cache-metrics'), None, user),
+            'token_obtain_pair': ('post', reverse('token_obtain_pair'),
+                                  {'username': 'benchmark', 'password': 'benchmark'}, None),
+            'token_refresh': ('post', reverse('token_refresh'), {'refresh': refresh}, None),
+        }
+
+        uncovered = {name for name in self.get_url_names(get_resolver().url_patterns)
+                     if name not in SKIPPED and name not in endpoints}
+        if uncovered:
+            raise CommandError(f'Routes without benchmark: {", ".join(sorted(uncovered))}')
+        return endpoints
+
+    def get_url_names(self, patterns):
+        for pattern in patterns:
+            if hasattr(pattern, 'url_patterns'):
+                # The Django admin has its own namespace
+                if pattern.namespace != 'admin':
+                    yield from self.get_url_names(pattern.url_patterns)
+            elif pattern.name:
+                yield pattern.name
+
+    def bench(self, endpoint, options):
+        method, url, data, user = endpoint
+        client = APIClient(SERVER_NAME='127.0.0.1')
+        if user is not None:
+            client.force_authenticate(user)
+        stats = {'count': 0}
+
+        def count_query(execute, sql, params, many, context):
+            stats['count'] += 1
+            return execute(sql, params, many, context)
+
+        def call():
+            if options['cold']:
+                response_cache.invalidate(*CACHE_TAGS)
+            response = getattr(client, method)(url, data, format='json')
+            if response.streaming:
+                # The streamed rows are read while the response is consumed
+                b''.join(response.streaming_content)
+            return response
+
+        for _ in range(options['warmup']):
+            call()
+        durations = []
+        statuses = set()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(count_query))
+            for _ in range(options['requests']):
+                start = time.perf_counter()
+                response = call()
+                durations.append(time.perf_counter() - start)
+                statuses.add(response.status_code)
+
+        centiles = statistics.quantiles(durations, n=100, method='inclusive')
+        return {
+            'method': method.upper(),
+            'url': url,
+            'status': ','.join(str(status) for status in sorted(statuses)),
+            'p50_ms': centiles[49] * 1000,
+            'p95_ms': centiles[94] * 1000,
+            'p99_ms': centiles[98] * 1000,
+            'mean_ms': statistics.mean(durations) * 1000,
+            'queries': stats['count'] / options['requests'],
+            'throughput_rps': len(durations) / sum(durations),
+        }
+
+    def compare(self, baseline, results, max_regression):
+        """Print the change of each metric since the baseline, return the names of the endpoints that regressed"""
+        self.stdout.write(self.style.SQL_TABLE(f"Compared with the run of {baseline.get('date')}"))
+        regressions = []
+        for name, result in results['endpoints'].items():
+            previous = baseline.get('endpoints', {}).get(name)
+            if previous is None:
+                self.stdout.write(f'{name:<24} new endpoint')
+                continue
+            changes = []
+            for metric in METRICS:
+                before, after = previous[metric], result[metric]
+                change = (after - before) / before * 100 if before else 0
+                changes.append(f'{metric} {before:.2f} -> {after:.2f} ({change:+.0f}%)')
+            p95_change = ((result['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100
+                          if previous['p95_ms'] else 0)
+            regressed = max_regression is not None and (p95_change > max_regression
+                                                        or result['queries'] > previous['queries'])
+            line = f"{name:<24} {', '.join(changes)}"
+            if regressed:
+                regressions.append(name)
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        return regressions
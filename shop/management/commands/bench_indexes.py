@@ -0,0 +1,109 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.request import Request
+
+from shop.models import Category, Product, Article
+from shop.synthetic import create_catalog
+from shop.views import CategoryViewset, ProductViewset, ArticleViewset
+
+
+class Command(BaseCommand):
+
+    help = 'Compare the query plans and latencies of the catalog queries with and without the catalog indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=100)
+        parser.add_argument('--products', type=int, default=100, help='Products per category')
+        parser.add_argument('--articles', type=int, default=100, help='Articles per product')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs of each query, the median is reported')
+        parser.add_argument('--no-seed', action='store_true', help='Benchmark the current catalog as is')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        self.repeat = options['repeat']
+
+        # Everything, including the synthetic catalog and the dropped indexes, is rolled back at the end
+        with transaction.atomic():
+            if not options['no_seed']:
+                start = time.perf_counter()
+                create_catalog(options['categories'], options['products'], options['articles'], seed=0)
+                self.stdout.write(f'Catalog created in {time.perf_counter() - start:.1f}s')
+            self.stdout.write(f'{Category.objects.count()} categories, {Product.objects.count()} products, '
+                              f'{Article.objects.count()} articles')
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+            queries = self.get_queries()
+            with_indexes = self.run(queries, phase=1)
+            self.drop_indexes()
+            without_indexes = self.run(queries, phase=2)
+
+            for name in queries:
+                self.stdout.write(self.style.SQL_TABLE(name))
+                for label, results in (('without indexes', without_indexes), ('with indexes', with_indexes)):
+                    plan, duration = results[name]
+                    self.stdout.write(f'  {label}: {duration * 1000:.3f}ms')
+                    for line in plan.splitlines():
+                        self.stdout.write(f'    {line}')
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS("All Done !"))
+
+    def get_queryset(self, viewset_class, action='list', **params):
+        """Build the queryset exactly as the viewset does for a request with ``params``"""
+        view = viewset_class()
+        view.action = action
+        view.request = Request(RequestFactory().get('/', params))
+        return view.get_queryset()
+
+    def get_queries(self):
+        """Return the benchmarked queries as (queryset, slice) where a ``None`` slice means a count query"""
+        category_id = Category.objects.filter(active=True).order_by('id').values_list('id', flat=True).first()
+        product_id = Product.objects.filter(active=True).order_by('id').values_list('id', flat=True).first()
+        page = slice(0, 10)
+        deep_offset = Article.objects.filter(active=True).count() // 2
+        since = timezone.now() - timedelta(hours=1)
+        return {
+            'CategoryViewset list': (self.get_queryset(CategoryViewset), page),
+            'ProductViewset list ?category_id=': (self.get_queryset(ProductViewset, category_id=category_id), page),
+            'ProductViewset count ?category_id=': (self.get_queryset(ProductViewset, category_id=category_id), None),
+            'ArticleViewset list': (self.get_queryset(ArticleViewset), page),
+            'ArticleViewset list deep page': (self.get_queryset(ArticleViewset),
+                                              slice(deep_offset, deep_offset + page.stop)),
+            'ArticleViewset list ?product_id=': (self.get_queryset(ArticleViewset, product_id=product_id), page),
+            'ArticleViewset count ?product_id=': (self.get_queryset(ArticleViewset, product_id=product_id), None),
+            'ArticleViewset list ?min_price=&max_price=': (
+                self.get_queryset(ArticleViewset, min_price='10', max_price='10.50'), page),
+            'Articles updated in the last hour': (Article.objects.filter(date_updated__gte=since), None),
+        }
+
+    def run(self, queries, phase):
+        results = {}
+        for name, (queryset, page) in queries.items():
+            # SQLite keeps the plans of the statements it already prepared on this connection,
+            # a condition specific to each phase makes sure the plans are computed again
+            queryset = queryset.extra(where=[f'{phase} = {phase}'])
+            if page is None:
+                explained, evaluate = queryset, queryset.count
+            else:
+                explained = queryset[page]
+                evaluate = lambda: list(queryset[page])  # noqa: E731
+            durations = []
+            for _ in range(self.repeat):
+                start = time.perf_counter()
+                evaluate()
+                durations.append(time.perf_counter() - start)
+            results[name] = (explained.explain(), statistics.median(durations))
+        return results
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for model in (Category, Product, Article):
+                for index in model._meta.indexes:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import Category, Product, Article
+from shop.serializers import CategoryListSerializer, ProductListSerializer, ArticleSerializer, ValuesSerializer
+from shop.synthetic import create_catalog
+
+
+class Command(BaseCommand):
+
+    help = 'Compare the throughput of the model serializers and of their values() fast path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Rows serialized for each serializer')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs of each serializer, the best is reported')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        rows = options['rows']
+
+        # The synthetic catalog is rolled back at the end
+        with transaction.atomic():
+            create_catalog(rows, 1, 1, active_ratio=1, seed=0)
+            for serializer_class, queryset in ((CategoryListSerializer, Category.objects.order_by('id')),
+                                               (ProductListSerializer, Product.objects.order_by('id')),
+                                               (ArticleSerializer, Article.objects.order_by('id'))):
+                queryset = queryset[:rows]
+                fast = ValuesSerializer.for_serializer(serializer_class)
+                model_duration = self.best_of(options['repeat'],
+                                              lambda: serializer_class(list(queryset), many=True).data)
+                fast_duration = self.best_of(options['repeat'],
+                                             lambda: fast.to_representation(queryset.values(*fast.sources)))
+                self.stdout.write(self.style.SQL_TABLE(serializer_class.__name__))
+                self.stdout.write(f'  model serializer: {rows / model_duration:,.0f} rows/s')
+                self.stdout.write(f'  values() fast path: {rows / fast_duration:,.0f} rows/s '
+                                  f'(x{model_duration / fast_duration:.1f})')
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS("All Done !"))
+
+    def best_of(self, repeat, function):
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - start)
+        return min(durations)
@@ -0,0 +1,148 @@
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from shop.database import PRAGMAS, apply_pragmas, get_setting
+
+# Reads of a product list page, the writes of an article price
+READ_QUERIES = [
+    'SELECT COUNT(*) FROM shop_product WHERE active',
+    'SELECT id, name, date_created, date_updated, category_id, ecoscore_grade, active_articles_count, min_price '
+    'FROM shop_product WHERE active AND id > ? ORDER BY id LIMIT 10',
+]
+WRITE_QUERY = 'UPDATE shop_article SET price = ?, date_updated = ? WHERE id = ?'
+
+
+class Command(BaseCommand):
+
+    help = 'Measure the throughput of concurrent SQLite readers and writers with and without the connection profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8, help='Threads reading product list pages')
+        parser.add_argument('--writers', type=int, default=2, help='Threads updating article prices')
+        parser.add_argument('--duration', type=float, default=5, help='Seconds each configuration runs')
+        parser.add_argument('--output', help='JSON file the results are written to')
+
+    def get_configurations(self):
+        """name: (pragmas, persistent connections)"""
+        profile = [(name.lower(), get_setting(name)) for name in PRAGMAS if get_setting(name) is not None]
+        return {
+            # Django's defaults: rollback journal, synchronous FULL and a new connection per request
+            'default': ([('journal_mode', 'delete')], False),
+            'profile': (profile, False),
+            'profile+persistent': (profile, True),
+        }
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('The default database is not SQLite')
+        if options['readers'] < 0 or options['writers'] < 0 or options['readers'] + options['writers'] == 0:
+            raise CommandError('At least one reader or writer is needed')
+
+        primary.ensure_connection()
+        product_ids = [row[0] for row in primary.connection.execute('SELECT id FROM shop_product WHERE active')]
+        article_ids = [row[0] for row in primary.connection.execute('SELECT id FROM shop_article')]
+        if not product_ids or not article_ids:
+            raise CommandError('The catalog needs an active product and an article, run generate_catalog')
+
+        results = {
+            'date': timezone.now().isoformat(),
+            'readers': options['readers'],
+            'writers': options['writers'],
+            'duration': options['duration'],
+            'configurations': {},
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            for name, (pragmas, persistent) in self.get_configurations().items():
+                # Each configuration runs on its own copy, the journal mode is stored in the file
+                path = os.path.join(directory, f'{name}.sqlite3')
+                target = sqlite3.connect(path)
+                try:
+                    primary.connection.backup(target)
+                finally:
+                    target.close()
+                results['configurations'][name] = result = self.run(path, pragmas, persistent, product_ids,
+                                                                    article_ids, options)
+                self.stdout.write(f"{name:<20} {result['reads_per_second']:9.1f} reads/s "
+                                  f"p95 {result['read_p95_ms']:7.2f}ms {result['writes_per_second']:8.1f} writes/s "
+                                  f"p95 {result['write_p95_ms']:7.2f}ms {result['errors']} error(s)")
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        self.stdout.write(self.style.SUCCESS("All Done !"))
+
+    def run(self, path, pragmas, persistent, product_ids, article_ids, options):
+        stats = {'read': [], 'write': [], 'errors': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['duration']
+
+        def read(connection, rng):
+            for query in READ_QUERIES:
+                connection.execute(query, [rng.choice(product_ids) - 1] if '?' in query else []).fetchall()
+
+        def write(connection, rng):
+            with connection:
+                connection.execute(WRITE_QUERY, [str(rng.randint(100, 9999) / 100), timezone.now().isoformat(),
+                                                 rng.choice(article_ids)])
+
+        def worker(kind, operation, seed):
+            rng = random.Random(seed)
+            latencies, errors, connection = [], 0, None
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    # Without persistent connections, each operation pays the connection setup, as a request would
+                    if connection is None:
+                        connection = sqlite3.connect(path, check_same_thread=False)
+                        apply_pragmas(connection, pragmas)
+                    operation(connection, rng)
+                    latencies.append(time.perf_counter() - start)
+                except sqlite3.OperationalError:
+                    # 'database is locked'
+                    errors += 1
+                if not persistent and connection is not None:
+                    connection.close()
+                    connection = None
+            if connection is not None:
+                connection.close()
+            with lock:
+                stats[kind] += latencies
+                stats['errors'] += errors
+
+        threads = [threading.Thread(target=worker, args=('read', read, index)) for index in range(options['readers'])]
+        threads += [threading.Thread(target=worker, args=('write', write, -index - 1))
+                    for index in range(options['writers'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+
+        def p95(latencies):
+            if len(latencies) < 2:
+                return latencies[0] * 1000 if latencies else 0
+            return statistics.quantiles(latencies, n=100)[94] * 1000
+
+        return {
+            'pragmas': dict(pragmas),
+            'persistent': persistent,
+            'reads_per_second': len(stats['read']) / duration,
+            'read_p95_ms': p95(stats['read']),
+            'writes_per_second': len(stats['write']) / duration,
+            'write_p95_ms': p95(stats['write']),
+            'errors': stats['errors'],
+        }
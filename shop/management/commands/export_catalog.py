@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.export import CHUNK_SIZE, FORMATS, export_catalog, parse_updated_since
+
+
+class Command(BaseCommand):
+
+    help = 'Export the active catalog as NDJSON or CSV, streamed row by row'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='export_format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--updated-since',
+                            help='Only export the rows updated since this ISO 8601 date, inactive ones included')
+        parser.add_argument('--output', help='File written, the standard output by default')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows fetched per database round trip')
+
+    def handle(self, *args, **options):
+        updated_since = options['updated_since']
+        if updated_since is not None:
+            updated_since = parse_updated_since(updated_since)
+            if updated_since is None:
+                raise CommandError('--updated-since expects an ISO 8601 date or date time')
+
+        lines = export_catalog(options['export_format'], updated_since, options['chunk_size'])
+        start = time.perf_counter()
+        count = -1 if options['export_format'] == 'csv' else 0  # the CSV header is not a row
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                for line in lines:
+                    output.write(line)
+                    count += 1
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
+                count += 1
+
+        # The summary goes to stderr so that the standard output only holds the export
+        self.stderr.write(f'{count} rows exported in {time.perf_counter() - start:.1f}s')
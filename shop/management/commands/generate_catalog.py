@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.cache import response_cache
+from shop.importer import CACHE_TAGS, delete_catalog
+from shop.synthetic import create_catalog
+
+
+def ratio(value):
+    value = float(value)
+    if not 0 <= value <= 1:
+        raise ValueError(value)
+    return value
+
+
+class Command(BaseCommand):
+
+    help = 'Generate a synthetic catalog to measure the API on realistic volumes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=100)
+        parser.add_argument('--products', type=int, default=1000, help='Products per category (fan-out)')
+        parser.add_argument('--articles', type=int, default=5, help='Articles per product (fan-out)')
+        parser.add_argument('--active-ratio', type=ratio, default=0.8,
+                            help='Share of active rows, for the levels without their own ratio')
+        parser.add_argument('--category-active-ratio', type=ratio)
+        parser.add_argument('--product-active-ratio', type=ratio)
+        parser.add_argument('--article-active-ratio', type=ratio)
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT')
+        parser.add_argument('--seed', type=int, help='Seed of the random generator, for a reproducible catalog')
+        parser.add_argument('--replace', action='store_true', help='Delete the current catalog first')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        if min(options['categories'], options['products'], options['articles']) < 0:
+            raise CommandError('Counts must be positive')
+
+        if options['replace']:
+            delete_catalog()
+
+        active_ratio = tuple(options[f'{level}_active_ratio'] if options[f'{level}_active_ratio'] is not None
+                             else options['active_ratio'] for level in ('category', 'product', 'article'))
+        start = time.perf_counter()
+        create_catalog(options['categories'], options['products'], options['articles'], active_ratio=active_ratio,
+                       batch_size=options['batch_size'], seed=options['seed'])
+        duration = time.perf_counter() - start
+        # bulk_create sends no signal
+        response_cache.invalidate(*CACHE_TAGS)
+
+        products = options['categories'] * options['products']
+        rows = options['categories'] + products + products * options['articles']
+        self.stdout.write(f"{options['categories']} categories, {products} products, "
+                          f"{products * options['articles']} articles")
+        self.stdout.write(f'{rows} rows in {duration:.1f}s ({rows / duration if duration else 0:,.0f} rows/s)')
+        self.stdout.write(self.style.SUCCESS("All Done !"))
@@ -0,0 +1,49 @@
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shop.importer import BATCH_SIZE, FORMATS, CatalogImporter, CatalogImportError, delete_catalog, guess_format, \
+    read_file
+
+
+class Command(BaseCommand):
+
+    help = 'Import catalog files (JSON lines or CSV), upserting the rows by natural key in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Files imported in order, parents before their children')
+        parser.add_argument('--format', dest='import_format', choices=FORMATS,
+                            help='Format of the files, guessed from their extension by default')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows written per model and batch')
+        parser.add_argument('--replace', action='store_true',
+                            help='Delete the current catalog first, in the same transaction as the import')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+
+        importer = CatalogImporter(batch_size=options['batch_size'])
+        # Replacing is all or nothing: a malformed file must not leave the catalog empty
+        with transaction.atomic() if options['replace'] else nullcontext():
+            if options['replace']:
+                delete_catalog()
+            for path in options['paths']:
+                import_format = options['import_format'] or guess_format(path)
+                if import_format not in FORMATS:
+                    raise CommandError(f'Cannot guess the format of {path}, use --format')
+                try:
+                    with open(path, encoding='utf-8', newline='') as file:
+                        importer.run(read_file(file, import_format))
+                except CatalogImportError as error:
+                    # Without --replace the previous batches are kept, the import can be run again once the file
+                    # is fixed
+                    raise CommandError(f'{path} {error}')
+
+        report(self, importer)
+        self.stdout.write(self.style.SUCCESS("All Done !"))
+
+
+def report(command, importer):
+    for kind, count in importer.counts.items():
+        command.stdout.write(f"{kind}: {count['created']} created, {count['updated']} updated")
+    command.stdout.write(f'{importer.rows} rows in {importer.duration:.2f}s ({importer.rows_per_second:,.0f} rows/s)')
@@ -1,7 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 
-from shop.models import Category
+from shop.importer import CatalogImporter, delete_catalog
+from shop.management.commands.import_catalog import report
 
 UserModel = get_user_model()
 
@@ -112,19 +113,25 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         self.stdout.write(self.style.MIGRATE_HEADING(self.help))
 
-        Category.objects.all().delete()
+        # One DELETE per table instead of collecting every related object in Python
+        delete_catalog()
 
-        for data_category in CATEGORIES:
-            category = Category.objects.create(name=data_category['name'],
-                                               active=data_category['active'])
-            for data_product in data_category['products']:
-                product = category.products.create(name=data_product['name'],
-                                                   active=data_product['active'])
-                for data_article in data_product['articles']:
-                    product.articles.create(name=data_article['name'],
-                                            active=data_article['active'],
-                                            price=data_article['price'])
+        importer = CatalogImporter()
+        importer.run(enumerate(self.get_records(), start=1))
+        report(self, importer)
 
         UserModel.objects.create_superuser(ADMIN_ID, 'admin@oc.drf', ADMIN_PASSWORD)
 
         self.stdout.write(self.style.SUCCESS("All Done !"))
+
+    def get_records(self):
+        """Flatten the CATEGORIES tree into the records of the catalog importer"""
+        for data_category in CATEGORIES:
+            yield {'type': 'category', 'name': data_category['name'], 'active': data_category['active']}
+            for data_product in data_category['products']:
+                yield {'type': 'product', 'category': data_category['name'], 'name': data_product['name'],
+                       'active': data_product['active']}
+                for data_article in data_product['articles']:
+                    yield {'type': 'article', 'category': data_category['name'], 'product': data_product['name'],
+                           'name': data_article['name'], 'active': data_article['active'],
+                           'price': data_article['price']}
@@ -0,0 +1,64 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import DecimalField, F, Q
+
+from shop.cache import response_cache
+from shop.models import (Category, Product, get_category_counters, get_product_counters, refresh_category_counters,
+                         refresh_product_counters)
+
+
+class Command(BaseCommand):
+
+    help = 'Recompute the counters of the categories and products and report the rows which had drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report the drift, and exit with an error when there is any')
+        parser.add_argument('--examples', type=int, default=10, help='Drifted rows shown per model')
+
+    def get_drifted(self, model, counters):
+        """Return the rows of ``model`` whose stored counters differ from the ``counters`` expressions"""
+        queryset = model.objects.annotate(**{f'expected_{name}': expression for name, expression in counters.items()})
+        matching = Q()
+        for name in counters:
+            # min_price is NULL for the products without active article
+            matching &= Q(**{name: F(f'expected_{name}')}) | Q(**{f'{name}__isnull': True,
+                                                                  f'expected_{name}__isnull': True})
+        return queryset.exclude(matching).order_by('id')
+
+    def format_value(self, model, name, value):
+        # The expected values read from the subqueries are not rounded to the decimal places of the field
+        field = model._meta.get_field(name)
+        if value is not None and isinstance(field, DecimalField):
+            return value.quantize(Decimal(1).scaleb(-field.decimal_places))
+        return value
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+
+        drift = 0
+        # Each counter only depends on the rows of the level below, the order does not matter
+        for label, model, counters, refresh in (
+                ('categories', Category, get_category_counters(), refresh_category_counters),
+                ('products', Product, get_product_counters(), refresh_product_counters)):
+            drifted = self.get_drifted(model, counters)
+            names = list(counters)
+            count = drifted.count()
+            drift += count
+            self.stdout.write(f'{label}: {count} drifted')
+            for row in drifted.values('id', *names, *(f'expected_{name}' for name in names))[:options['examples']]:
+                changes = ', '.join(
+                    f"{name} {row[name]} -> {self.format_value(model, name, row[f'expected_{name}'])}"
+                    for name in names if row[name] != row[f'expected_{name}'])
+                self.stdout.write(f"  #{row['id']}: {changes}")
+            if count and not options['check']:
+                refresh(drifted.values('id'))
+                response_cache.invalidate(model._meta.model_name, f'{model._meta.model_name}:bulk', 'category:bulk')
+
+        if options['check']:
+            if drift:
+                raise CommandError(f'{drift} row(s) with drifted counters')
+        elif drift:
+            self.stdout.write(f'{drift} row(s) fixed')
+        self.stdout.write(self.style.SUCCESS("All Done !"))
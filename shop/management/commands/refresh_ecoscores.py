@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from shop.cache import response_cache
+from shop.ecoscore import get_setting, resolve_ecoscores
+from shop.models import Product
+
+
+class Command(BaseCommand):
+
+    help = 'Refresh the stored ecoscore of the products whose ecoscore is missing or stale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=get_setting('REFRESH_MAX_AGE'),
+                            help='Seconds after which a stored ecoscore is considered stale')
+        parser.add_argument('--all', action='store_true', help='Refresh every product, stale or not')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Products fetched concurrently then written with a single bulk_update')
+        parser.add_argument('--timeout', type=float, default=get_setting('PAGE_TIMEOUT'),
+                            help='Seconds a batch waits for its ecoscores')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+
+        queryset = Product.objects.exclude(barcode='')
+        if not options['all']:
+            limit = timezone.now() - timedelta(seconds=options['max_age'])
+            queryset = queryset.filter(Q(date_ecoscore_refreshed__isnull=True) | Q(date_ecoscore_refreshed__lt=limit))
+        queryset = queryset.only('id', 'barcode', 'ecoscore_grade', 'date_ecoscore_refreshed', 'date_updated')
+        queryset = queryset.order_by('id')
+
+        refreshed = failed = 0
+        last_id = 0
+        while True:
+            # Walk the table by primary key so that each batch is a cheap indexed query
+            batch = list(queryset.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            # Past the cache, which would answer with the grade (or the failure) this run is meant to replace
+            ecoscores = resolve_ecoscores(batch, timeout=options['timeout'], refresh=True)
+            now = timezone.now()
+            to_update = []
+            for product in batch:
+                grade = ecoscores.get(product.barcode)
+                if grade is None:
+                    # Stale while revalidate: the previous ecoscore keeps being served and is retried next run
+                    failed += 1
+                    continue
+                product.date_ecoscore_refreshed = now
+                if grade != product.ecoscore_grade:
+                    product.ecoscore_grade = grade
+                    # bulk_update skips auto_now, the product changed for the HTTP validators
+                    product.date_updated = now
+                to_update.append(product)
+            Product.objects.bulk_update(to_update, ['ecoscore_grade', 'date_ecoscore_refreshed', 'date_updated'])
+            refreshed += len(to_update)
+
+        if refreshed:
+            # bulk_update sends no signal, the category details embed the products too
+            response_cache.invalidate('product', 'product:bulk', 'category:bulk')
+
+        self.stdout.write(f'{refreshed} ecoscore(s) refreshed, {failed} kept stale')
+        self.stdout.write(self.style.SUCCESS("All Done !"))
@@ -0,0 +1,34 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+
+    help = 'Copy the primary SQLite database to a local replica, standing in for the replication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='replica', help='Alias of the replica in DATABASES')
+        parser.add_argument('--output', help='File written instead of the one of the replica')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        if options['database'] not in connections:
+            raise CommandError(f"Unknown database {options['database']!r}")
+        primary, replica = connections[DEFAULT_DB_ALIAS], connections[options['database']]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('Only SQLite databases can be copied, use the replication of your database')
+        path = options['output'] or replica.settings_dict['NAME']
+        if str(path) == str(primary.settings_dict['NAME']):
+            raise CommandError('The replica is the primary database')
+
+        # The online backup API copies the schema and the rows page by page, the primary stays usable meanwhile
+        primary.ensure_connection()
+        target = sqlite3.connect(path)
+        try:
+            primary.connection.backup(target)
+        finally:
+            target.close()
+        self.stdout.write(f'{primary.settings_dict["NAME"]} copied to {path}')
+        self.stdout.write(self.style.SUCCESS("All Done !"))
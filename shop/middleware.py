@@ -0,0 +1,124 @@
+import asyncio
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from shop.routers import primary_stickiness, routing_state
+
+# Query statistics of the request being handled. A context variable follows the request from the event loop
+# to the threads running its ORM calls (sync_to_async), which the per-thread connections do not
+query_stats = ContextVar('query_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper installed on every database connection (see shop/signals.py)"""
+    stats = query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats['count'] += 1
+        stats['duration'] += time.perf_counter() - start
+
+
+class QueryCountMiddleware:
+    """
+    Count the SQL queries issued while handling each request and the time spent running them.
+    Both are returned in the ``X-Query-Count`` and ``X-Query-Time-Ms`` response headers,
+    so that N+1 regressions show up in the browser, the logs and the tests.
+    Only in DEBUG or with the ``QUERY_COUNT_HEADERS`` setting: in production they would tell any client how
+    costly each endpoint is.
+    Works for both sync and async requests, so that it does not force the async views to run in a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Mark the instance as a coroutine function for the handler, as django's MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def is_enabled(self):
+        return settings.DEBUG or getattr(settings, 'QUERY_COUNT_HEADERS', False)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.is_enabled():
+            return self.get_response(request)
+        stats = {'count': 0, 'duration': 0.0}
+        token = query_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            query_stats.reset(token)
+        return self.add_headers(response, stats)
+
+    async def __acall__(self, request):
+        if not self.is_enabled():
+            return await self.get_response(request)
+        stats = {'count': 0, 'duration': 0.0}
+        token = query_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            query_stats.reset(token)
+        return self.add_headers(response, stats)
+
+    def add_headers(self, response, stats):
+        # Streaming responses run their queries while being consumed, only the view part is counted here
+        response['X-Query-Count'] = str(stats['count'])
+        response['X-Query-Time-Ms'] = f"{stats['duration'] * 1000:.2f}"
+        return response
+
+
+class DatabaseRoutingMiddleware:
+    """
+    Hold the database routing state of each request (see shop/routers.py): the replica its reads go to,
+    returned in the ``X-Read-Database`` response header, and whether it wrote, in which case its user
+    reads from the primary for the next few seconds.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = {'replica': None, 'wrote': False}
+        token = routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        if state['wrote']:
+            # DRF sets the user it authenticated on the Django request too
+            primary_stickiness.mark(getattr(request, 'user', None))
+        return self.add_header(response, state)
+
+    async def __acall__(self, request):
+        state = {'replica': None, 'wrote': False}
+        token = routing_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        if state['wrote']:
+            # Reading the user of the session queries the database
+            await sync_to_async(primary_stickiness.mark)(getattr(request, 'user', None))
+        return self.add_header(response, state)
+
+    def add_header(self, response, state):
+        response['X-Read-Database'] = state['replica'] or 'default'
+        return response
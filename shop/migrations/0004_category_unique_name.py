@@ -0,0 +1,46 @@
+# Generated by Django 3.2.5 on 2026-10-18 07:27
+
+from django.db import migrations, models
+
+
+def make_unique_name(name, pk, taken, max_length):
+    """Return ``name`` with the id appended, shortened so that the suffix fits, and not in ``taken``"""
+    suffix = f' ({pk})'
+    attempt = 1
+    while True:
+        unique_name = name[:max_length - len(suffix)] + suffix
+        if unique_name not in taken:
+            return unique_name
+        attempt += 1
+        suffix = f' ({pk}-{attempt})'
+
+
+def rename_duplicates(apps, schema_editor):
+    # The constraint cannot be created while names are duplicated, the newest categories get their id appended
+    Category = apps.get_model('shop', 'Category')
+    max_length = Category._meta.get_field('name').max_length
+    categories = list(Category.objects.order_by('id').only('id', 'name'))
+    # A renamed category must not take the name of another one, later in the table included
+    taken = {category.name for category in categories}
+    kept = set()
+    for category in categories:
+        if category.name in kept:
+            category.name = make_unique_name(category.name, category.pk, taken, max_length)
+            category.save(update_fields=['name'])
+            taken.add(category.name)
+        kept.add(category.name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='category',
+            constraint=models.UniqueConstraint(fields=('name',), name='category_unique_name'),
+        ),
+    ]
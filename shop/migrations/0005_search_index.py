@@ -0,0 +1,59 @@
+from django.db import migrations
+
+# Frozen copy of the statements of shop/search.py at the time of this migration, which must not change with it
+TABLES = ['shop_product', 'shop_article']
+
+CREATE_TABLE = """CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+    name, description, content='{table}', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+)"""
+REBUILD = "INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')"
+CREATE_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+        INSERT INTO {table}_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF name, description ON {table} BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {table}_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+DROP = [
+    'DROP TRIGGER IF EXISTS {table}_fts_update',
+    'DROP TRIGGER IF EXISTS {table}_fts_delete',
+    'DROP TRIGGER IF EXISTS {table}_fts_insert',
+    'DROP TABLE IF EXISTS {table}_fts',
+]
+
+
+def execute(schema_editor, statements):
+    # Full-text indexes of the products and articles, SQLite only (FTS5), other databases search with LIKE
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            for statement in statements:
+                cursor.execute(statement.format(table=table))
+
+
+def create_index(apps, schema_editor):
+    execute(schema_editor, [CREATE_TABLE, *CREATE_TRIGGERS, REBUILD])
+
+
+def drop_index(apps, schema_editor):
+    execute(schema_editor, DROP)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_category_unique_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-18 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(condition=models.Q(('active', True)), fields=['price'], name='article_price_active_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.5 on 2026-10-18 07:35
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def compute_counters(apps, schema_editor):
+    # Same computation as refresh_product_counters and refresh_category_counters, on the historical models
+    Category = apps.get_model('shop', 'Category')
+    Product = apps.get_model('shop', 'Product')
+    Article = apps.get_model('shop', 'Article')
+    now = timezone.now()
+
+    articles = Article.objects.filter(product=OuterRef('pk'), active=True).order_by().values('product')
+    Product.objects.update(
+        active_articles_count=Coalesce(Subquery(articles.annotate(count=Count('pk')).values('count')), 0),
+        min_price=Subquery(articles.annotate(min_price=Min('price')).values('min_price')),
+        # The responses change, so do their validators
+        date_updated=now,
+    )
+    products = Product.objects.filter(category=OuterRef('pk'), active=True).order_by().values('category')
+    Category.objects.update(
+        active_products_count=Coalesce(Subquery(products.annotate(count=Count('pk')).values('count')), 0),
+        date_updated=now,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_article_price_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='active_products_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='active_articles_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='min_price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=4, null=True),
+        ),
+        migrations.RunPython(compute_counters, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,11 @@
 Nous allons donc mocker cet appel pour qu’il puisse être réalisé dans toutes les conditions.
 sans connexion Internet
 """
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import requests
 
 # the ecoscore is stored in a constant and will be reused in our tests
@@ -22,3 +27,60 @@ def mock_openfoodfact_success(self, method, url):
     # nous n'appelons pas la méthode mais la remplaçons
     response.json = monkey_json
     return response
+
+
+def mock_openfoodfact_failure(self, method, url):
+    # The upstream is unavailable, the ecoscore cannot be retrieved
+    response = requests.Response()
+    response.status_code = 503
+    return response
+
+
+class OpenFoodFactsStubServer:
+    """
+    Local HTTP server standing in for OpenFoodFacts, to test the real HTTP client (pool, timeouts, retries,
+    circuit breaker) without Internet access. Use it as a context manager and point ``ECOSCORE['URL']``
+    to ``server.url``. ``status`` and ``delay`` can be changed while the server is running.
+    """
+
+    def __init__(self, status=200, delay=0):
+        self.status = status
+        self.delay = delay
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                stub.requests.append(self.path)
+                time.sleep(stub.delay)
+                body = json.dumps({'product': {'ecoscore_grade': ECOSCORE_GRADE}}).encode()
+                try:
+                    self.send_response(stub.status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except ConnectionError:
+                    # The client gave up waiting (timeout tests)
+                    pass
+
+            def log_message(self, format, *args):
+                # Keep the test output clean
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}/api/v0/product/{{barcode}}.json'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
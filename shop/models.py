@@ -1,5 +1,14 @@
-import requests
 from django.db import models, transaction
+from django.db.models import Count, Min, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from shop.cache import response_cache
+from shop.clients import openfoodfacts_client, openfoodfacts_flight
+from shop.ecoscore import ecoscore_cache, get_setting
+
+# Barcode given to products created without one (it used to be hardcoded for every product)
+DEFAULT_BARCODE = '3229820787015'
 
 
 class Category(models.Model):
@@ -10,33 +19,33 @@ class Category(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     active = models.BooleanField(default=False)
+    # Counter maintained by refresh_category_counters on every write changing it
+    active_products_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Public listing: active categories ordered by id
+            models.Index(fields=['id'], condition=Q(active=True), name='category_active_idx'),
+            models.Index(fields=['date_updated'], name='category_date_updated_idx'),
+        ]
+        constraints = [
+            # Checked by the database, the serializers turn the IntegrityError into a validation error
+            models.UniqueConstraint(fields=['name'], name='category_unique_name'),
+        ]
 
     def __str__(self):
         return self.name
 
-    @transaction.atomic  # in case of error, we would then return to the previous state
     def disable(self):
-        if self.active is False:
-            # Let's do nothing if the category is already disabled
-            return
+        """Disable the category with all of its products and their articles,
+        return the number of rows changed per model."""
         self.active = False
-        self.save()
-        # let's deactivate products in this category
-        self.products.update(active=False)
+        return cascade_activation(False, category_ids=[self.pk])
 
-    @transaction.atomic
     def enable(self):
-        """The enable method will check if the category is inactive,
-        then enable the category and all associated products."""
-        if self.active:
-            # Debug
-            print(f"Category '{self.name}' is already enabled.")
-            return
-        # Debug
-        print(f"Enabling category '{self.name}'")
+        """The enable method will enable the category and all associated products and articles."""
         self.active = True
-        self.save()
-        self.products.update(active=True)
+        return cascade_activation(True, category_ids=[self.pk])
 
 
 class Product(models.Model):
@@ -50,30 +59,64 @@ class Product(models.Model):
 
     category = models.ForeignKey('shop.Category', on_delete=models.CASCADE, related_name='products')
 
+    barcode = models.CharField(max_length=32, blank=True, default=DEFAULT_BARCODE)
+    # Ecoscore stored by the refresh_ecoscores command, so that reading products makes no outbound call
+    ecoscore_grade = models.CharField(max_length=16, blank=True, null=True)
+    date_ecoscore_refreshed = models.DateTimeField(null=True, blank=True)
+    # Counters of the active articles maintained by refresh_product_counters on every write changing them
+    active_articles_count = models.PositiveIntegerField(default=0, editable=False)
+    min_price = models.DecimalField(max_digits=4, decimal_places=2, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Active products of a category ordered by id (ProductViewset ?category_id=)
+            models.Index(fields=['category', 'id'], condition=Q(active=True), name='product_category_active_idx'),
+            models.Index(fields=['id'], condition=Q(active=True), name='product_active_idx'),
+            models.Index(fields=['date_updated'], name='product_date_updated_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
-    @transaction.atomic
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the category the product was loaded with, to invalidate it too if the product moves
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        # and the state counted by its category (see shop/signals.py)
+        instance._loaded_counted = (instance._loaded_category_id, instance.__dict__.get('active'))
+        return instance
+
     def disable(self):
-        if not self.active:
-            return
+        """Disable the product and its articles, return the number of rows changed per model."""
         self.active = False
-        self.save()
-        self.articles.update(active=False)
+        return cascade_activation(False, product_ids=[self.pk])
 
     def call_external_api(self, method, url):  # Call an external API This method will be monkey patched
-        return requests.request(method, url)
+        # Pooled session with timeouts, retries and circuit breaker.
+        # Identical concurrent calls wait for the one in flight and share its response
+        return openfoodfacts_flight.do((method, url), openfoodfacts_client.request, method, url)
 
-    @property
-    # property that calls the API and returns the ecoscore
-    def ecoscore(self):
+    def fetch_ecoscore(self):
+        if not self.barcode:
+            return None
         # call for open food fact
-        url = 'https://world.openfoodfacts.org/api/v0/product/3229820787015.json'
+        url = get_setting('URL').format(barcode=self.barcode)
         response = self.call_external_api('GET', url)
         if response.status_code == 200:
             # return the ecoscore if the response is valid
             return response.json()['product']['ecoscore_grade']
 
+    @property
+    # property that returns the live ecoscore, the API is only called when the barcode is not cached yet
+    def ecoscore(self):
+        if not self.barcode:
+            return None
+        return ecoscore_cache.get_or_fetch(self.barcode, self.fetch_ecoscore)
+
+    def invalidate_ecoscore(self):
+        ecoscore_cache.invalidate(self.barcode)
+
 
 class Article(models.Model):
 
@@ -87,5 +130,105 @@ class Article(models.Model):
 
     product = models.ForeignKey('shop.Product', on_delete=models.CASCADE, related_name='articles')
 
+    class Meta:
+        indexes = [
+            # Active articles of a product ordered by id (ArticleViewset ?product_id=)
+            models.Index(fields=['product', 'id'], condition=Q(active=True), name='article_product_active_idx'),
+            models.Index(fields=['id'], condition=Q(active=True), name='article_active_idx'),
+            # Price ranges of the active articles (ArticleViewset ?min_price= and ?max_price=)
+            models.Index(fields=['price'], condition=Q(active=True), name='article_price_active_idx'),
+            models.Index(fields=['date_updated'], name='article_date_updated_idx'),
+        ]
+
     def __str__(self):
         return self.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_product_id = instance.__dict__.get('product_id')
+        instance._loaded_counted = (instance._loaded_product_id, instance.__dict__.get('active'),
+                                    instance.__dict__.get('price'))
+        return instance
+
+
+def cascade_activation(active, category_ids=None, product_ids=None):
+    """
+    Set the active flag of the given categories with their products and articles, or of the given products
+    with their articles. Each level is a single set-based UPDATE, whatever the number of rows:
+    ``UPDATE article ... WHERE product_id IN (SELECT id FROM product WHERE category_id IN (...))``.
+    Only the rows whose flag changes are touched, and their date_updated is set (update() skips auto_now).
+    The counters of the products and categories whose children changed are computed again in the same transaction.
+    ``category_ids`` and ``product_ids`` may be lists of ids or ``values('id')`` querysets.
+    Return the number of rows changed per model.
+    """
+    if (category_ids is None) == (product_ids is None):
+        raise ValueError('Give either category_ids or product_ids')
+
+    changes = {'active': active, 'date_updated': timezone.now()}
+    counts = {'categories': 0, 'products': 0, 'articles': 0}
+    # in case of error, we would then return to the previous state
+    with transaction.atomic():
+        if category_ids is not None:
+            counts['categories'] = Category.objects.filter(id__in=category_ids).exclude(active=active).update(**changes)
+            products = Product.objects.filter(category_id__in=category_ids)
+            product_ids = products.values('id')
+        else:
+            products = Product.objects.filter(id__in=product_ids)
+        counts['products'] = products.exclude(active=active).update(**changes)
+        counts['articles'] = Article.objects.filter(product_id__in=product_ids).exclude(active=active).update(**changes)
+        if counts['articles']:
+            refresh_product_counters(product_ids)
+        if counts['products']:
+            refresh_category_counters(category_ids if category_ids is not None else products.values('category_id'))
+
+    # update() sends no signal, the cached responses of the changed models are invalidated here
+    tags = []
+    for model, count in (('category', counts['categories']), ('product', counts['products']),
+                         ('article', counts['articles'])):
+        if count:
+            tags += [model, f'{model}:bulk']
+    if counts['products']:
+        # The category details embed their products, the lists show their counters
+        tags += ['category', 'category:bulk']
+    if counts['articles']:
+        # and the counters of the products
+        tags += ['product', 'product:bulk', 'category:bulk']
+    if tags:
+        response_cache.invalidate(*tags)
+    return counts
+
+
+def get_product_counters():
+    """Expressions computing the counters of a product from its active articles"""
+    articles = Article.objects.filter(product=OuterRef('pk'), active=True).order_by().values('product')
+    return {
+        'active_articles_count': Coalesce(Subquery(articles.annotate(count=Count('pk')).values('count')), 0),
+        'min_price': Subquery(articles.annotate(min_price=Min('price')).values('min_price')),
+    }
+
+
+def get_category_counters():
+    """Expressions computing the counters of a category from its active products"""
+    products = Product.objects.filter(category=OuterRef('pk'), active=True).order_by().values('category')
+    return {
+        'active_products_count': Coalesce(Subquery(products.annotate(count=Count('pk')).values('count')), 0),
+    }
+
+
+def refresh_product_counters(product_ids=None):
+    """
+    Recompute the counters of the given products (list of ids or ``values('id')`` queryset, every product for None)
+    with a single UPDATE, each counter being a subquery on the indexed active articles of the product.
+    The minimum price cannot be maintained by increments when an article goes away, so the counters of the
+    products touched by a write are computed again instead. Their date_updated changes, for the HTTP validators.
+    Return the number of products updated.
+    """
+    queryset = Product.objects.all() if product_ids is None else Product.objects.filter(id__in=product_ids)
+    return queryset.update(**get_product_counters(), date_updated=timezone.now())
+
+
+def refresh_category_counters(category_ids=None):
+    """Recompute the counters of the given categories, like refresh_product_counters"""
+    queryset = Category.objects.all() if category_ids is None else Category.objects.filter(id__in=category_ids)
+    return queryset.update(**get_category_counters(), date_updated=timezone.now())
@@ -0,0 +1,113 @@
+"""
+Banned words of the category names.
+
+The words are read from a text file (``MODERATION['BANNED_WORDS_FILE']``, one word per line, ``#`` for comments)
+into an Aho–Corasick automaton: a name is scanned once, character by character, whatever the number of words,
+so the validation cost does not grow with the dictionary. A word matches anywhere in the name, case insensitively.
+The file is loaded again when its modification time changes, checked at most every ``CHECK_INTERVAL`` seconds.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+DEFAULTS = {
+    'BANNED_WORDS_FILE': os.path.join(os.path.dirname(__file__), 'banned_words.txt'),
+    'CHECK_INTERVAL': 5,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'MODERATION', {}).get(name, DEFAULTS[name])
+
+
+class AhoCorasick:
+    """Multiple pattern matcher, built once for a list of words"""
+
+    def __init__(self, words):
+        # Trie stored as one transition dict per state, state 0 being the root
+        self.transitions = [{}]
+        self.outputs = [None]
+        for word in words:
+            state = 0
+            for char in word:
+                if char not in self.transitions[state]:
+                    self.transitions.append({})
+                    self.outputs.append(None)
+                    self.transitions[state][char] = len(self.transitions) - 1
+                state = self.transitions[state][char]
+            self.outputs[state] = word
+
+        # Failure links: the longest proper suffix of the state which is also a state, computed breadth first
+        self.fail = [0] * len(self.transitions)
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.transitions[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.transitions[fallback].get(char, 0)
+                if child == self.fail[child]:
+                    self.fail[child] = 0
+                # A state also matches the words ending at its failure state ('spam' inside 'antispam')
+                if self.outputs[child] is None:
+                    self.outputs[child] = self.outputs[self.fail[child]]
+
+    def search(self, text):
+        """Return the first word found in ``text``, or None"""
+        state = 0
+        transitions, fail, outputs = self.transitions, self.fail, self.outputs
+        for char in text:
+            while state and char not in transitions[state]:
+                state = fail[state]
+            state = transitions[state].get(char, 0)
+            if outputs[state] is not None:
+                return outputs[state]
+        return None
+
+
+class BannedWords:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._matcher = AhoCorasick([])
+        self._loaded = None  # (path, modification time) of the loaded file
+        self._checked_at = 0
+
+    def load(self, path):
+        with open(path, encoding='utf-8') as file:
+            words = {line.strip().casefold() for line in file}
+        return AhoCorasick(sorted(word for word in words if word and not word.startswith('#')))
+
+    def get_matcher(self):
+        now = time.monotonic()
+        path = get_setting('BANNED_WORDS_FILE')
+        recently_checked = now - self._checked_at < get_setting('CHECK_INTERVAL')
+        if self._loaded is not None and self._loaded[0] == path and recently_checked:
+            return self._matcher
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                # No file, no banned word
+                self._matcher, self._loaded = AhoCorasick([]), (path, None)
+                return self._matcher
+            if self._loaded != (path, mtime):
+                self._matcher, self._loaded = self.load(path), (path, mtime)
+            return self._matcher
+
+    def search(self, text):
+        """Return the first banned word found in ``text``, or None"""
+        return self.get_matcher().search(text.casefold())
+
+    def reset(self):
+        with self._lock:
+            self._loaded = None
+
+
+banned_words = BannedWords()
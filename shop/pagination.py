@@ -0,0 +1,11 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key. The opaque cursor holds the last id of the page,
+    so every page is a ``WHERE id > ... ORDER BY id LIMIT ...`` query and no ``COUNT(*)`` is issued:
+    deep pages cost the same as the first one.
+    """
+
+    ordering = 'id'
@@ -0,0 +1,103 @@
+"""
+Routing of the queries between the primary database and its read replicas.
+
+Every write goes to the primary (``default``), as well as every read by default. The read-only catalog viewsets ask
+for a replica (``read_from_replica``) for their GET, HEAD and OPTIONS requests: one of ``DATABASE_ROUTING['REPLICAS']``
+is picked for the whole request, so that its queries all see the same state of the data.
+
+A replica lags behind the primary: a user who has just written would not find the change on the next page read.
+When a request writes to the catalog (the models of ``STICKY_APPS``), its user reads from the primary for
+``STICKY_SECONDS`` afterwards (read-your-writes); saving a session or a token does not count. The mark is kept in the
+cache under the user id, so it works for JWT clients which keep no session. For the same reason the responses read
+from a replica are not stored in the response cache (shop/cache.py), they would outlive the invalidation.
+
+The state of the request is held by a context variable set by ``DatabaseRoutingMiddleware`` (shop/middleware.py),
+outside of a request (commands, shell) everything goes to the primary. Locally, a second SQLite file stands in for
+the replica, see the sync_replica command.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+DEFAULTS = {
+    'REPLICAS': [],
+    'STICKY_SECONDS': 5,
+    'STICKY_APPS': ['shop'],
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'db-primary',
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'DATABASE_ROUTING', {}).get(name, DEFAULTS[name])
+
+
+# {'replica': alias of the replica read by the request or None, 'wrote': True once the request wrote}
+routing_state = ContextVar('routing_state', default=None)
+
+
+class PrimaryStickiness:
+    """Users who wrote in the last STICKY_SECONDS, and must read from the primary"""
+
+    @property
+    def backend(self):
+        return caches[get_setting('CACHE_ALIAS')]
+
+    def make_key(self, user_id):
+        return f"{get_setting('KEY_PREFIX')}:{user_id}"
+
+    def mark(self, user):
+        if user is not None and user.is_authenticated:
+            self.backend.set(self.make_key(user.pk), True, get_setting('STICKY_SECONDS'))
+
+    def is_sticky(self, user):
+        return user is not None and user.is_authenticated and self.backend.get(self.make_key(user.pk)) is not None
+
+
+primary_stickiness = PrimaryStickiness()
+
+
+def current_replica():
+    """Return the alias of the replica read by the current request, None when it reads from the primary"""
+    state = routing_state.get()
+    return state['replica'] if state is not None else None
+
+
+def read_from_replica(user):
+    """Send the reads of the current request to a replica, unless ``user`` wrote recently. Return its alias or None"""
+    state = routing_state.get()
+    replicas = get_setting('REPLICAS')
+    if state is None or not replicas or primary_stickiness.is_sticky(user):
+        return None
+    if state['replica'] is None:
+        state['replica'] = random.choice(replicas)
+    return state['replica']
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return current_replica()
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None and model._meta.app_label in get_setting('STICKY_APPS'):
+            state['wrote'] = True
+        # Explicit, an instance read from a replica would otherwise be saved where it was read
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *get_setting('REPLICAS')}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replicas receive the schema with the data
+        if db in get_setting('REPLICAS'):
+            return False
+        return None
@@ -0,0 +1,91 @@
+"""
+Full-text search of the products and articles, on their name and description.
+
+On SQLite, each model has an FTS5 index (``shop_product_fts``, ``shop_article_fts``) created by the migration 0005.
+They are external content tables: the text is only stored in the model tables, and triggers keep the index in sync
+with every write, including bulk_create, bulk_update, update() and raw SQL, which send no signal. Django rebuilds a
+SQLite table to alter it, which drops its triggers, so they are created again after each migrate (shop/signals.py).
+
+Results are ranked with bm25, a match in the name weighing more than one in the description. The words of the query
+must all be found, the last one being a prefix to search as you type. Other databases fall back to a LIKE search.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+TABLES = ['shop_product', 'shop_article']
+# Weight of the name and description columns in the rank
+WEIGHTS = (10.0, 1.0)
+MAX_LIMIT = 100
+
+CREATE_TABLE = """CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+    name, description, content='{table}', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+)"""
+REBUILD = "INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')"
+CREATE_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+        INSERT INTO {table}_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF name, description ON {table} BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {table}_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+DROP = [
+    'DROP TRIGGER IF EXISTS {table}_fts_update',
+    'DROP TRIGGER IF EXISTS {table}_fts_delete',
+    'DROP TRIGGER IF EXISTS {table}_fts_insert',
+    'DROP TABLE IF EXISTS {table}_fts',
+]
+
+
+def is_supported(using_connection=connection):
+    return using_connection.vendor == 'sqlite'
+
+
+def execute(cursor, statements):
+    for table in TABLES:
+        for statement in statements:
+            cursor.execute(statement.format(table=table))
+
+
+def build_match(query):
+    """Return the FTS5 query of the words typed by the user, or None when there is no word"""
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    # Quoted, the words cannot be read as FTS5 operators
+    return ' '.join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+
+
+def search(queryset, query, limit=20):
+    """Return the ids of the rows of ``queryset`` (products or articles) matching ``query``, best first"""
+    if not is_supported():
+        words = re.findall(r'\w+', query)
+        if not words:
+            return []
+        condition = Q()
+        for word in words:
+            condition &= Q(name__icontains=word) | Q(description__icontains=word)
+        return list(queryset.filter(condition).order_by('id').values_list('id', flat=True)[:limit])
+
+    match = build_match(query)
+    if match is None:
+        return []
+    table = f'{queryset.model._meta.db_table}_fts'
+    # The FTS index gives the best ranked rows and the queryset applies its own filters (active...) on them
+    ranked = queryset.extra(
+        tables=[table],
+        where=[f'{table}.rowid = {queryset.model._meta.db_table}.id', f'{table} MATCH %s'],
+        params=[match],
+        select={'search_rank': f'bm25({table}, %s, %s)'},
+        select_params=WEIGHTS,
+    )
+    return list(ranked.order_by('search_rank', 'id').values_list('id', flat=True)[:limit])
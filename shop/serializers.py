@@ -1,5 +1,14 @@
-from rest_framework import serializers
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 from shop.models import Category, Product, Article
+from shop.moderation import banned_words
 
 
 class CategoryListSerializer(serializers.ModelSerializer):
@@ -7,29 +16,22 @@ class CategoryListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         # adding "description" to our list of fields
-        fields = ['id', 'name', 'date_created', 'date_updated', 'description']
+        # and the number of active products, a counter stored on the category (read only)
+        fields = ['id', 'name', 'date_created', 'date_updated', 'description', 'active_products_count']
 
     # modify our list serializer because it is used for the create action
     def validate_name(self, value):
         """
-        This method first checks if a category with the same name exists.
-        Otherwise, it then checks if the name contains prohibited words from a predefined list.
+        This method checks if the name contains prohibited words from the banned words file (see shop/moderation.py).
         If a forbidden word is found, a ValidationError is raised.
+        The uniqueness of the name is checked by the database when saving, see create() and update().
         """
-        # We check that the category exists
-        if Category.objects.filter(name=value).exists():
-            # In the event of an error, DRF provides us with the ValidationError exception
-            raise serializers.ValidationError('Category already exists')
-
         # We could imagine a word filter system for a forum, for example
         # Added additional validations (like a banned word filter)
-        # List of prohibited words
-        forbidden_words = ["spam", "advertisement", "banned"]
-
-        # Check if the name contains banned words
-        for word in forbidden_words:
-            if word in value.lower():
-                raise serializers.ValidationError(f"The name contains a forbidden word: {word}")
+        word = banned_words.search(value)
+        if word is not None:
+            # In the event of an error, DRF provides us with the ValidationError exception
+            raise serializers.ValidationError(_('The name contains a forbidden word: %(word)s') % {'word': word})
 
         return value
 
@@ -40,6 +42,27 @@ class CategoryListSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Name must be in description')
         return data
 
+    def save_unique(self, save, *args):
+        # No query before saving to know if the name is taken: it would be racy, the unique constraint is not
+        try:
+            with transaction.atomic():
+                return save(*args)
+        except IntegrityError:
+            raise serializers.ValidationError({'name': [_('Category already exists')]})
+
+    def create(self, validated_data):
+        return self.save_unique(super().create, validated_data)
+
+    def update(self, instance, validated_data):
+        return self.save_unique(super().update, instance, validated_data)
+
+
+class CategoryActivationSerializer(serializers.Serializer):
+    """Payload of the bulk activation of categories"""
+
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=10000)
+    active = serializers.BooleanField()
+
 
 class CategoryDetailSerializer(serializers.ModelSerializer):
 
@@ -57,22 +80,37 @@ class CategoryDetailSerializer(serializers.ModelSerializer):
         # add the list of IDs in an attribute with the same name as the related_name=='products'
         fields = ['id', 'name', 'date_created', 'date_updated', 'products']
 
+    @staticmethod
+    def prefetch(queryset):
+        """Load the active products of every category of the queryset with a single query"""
+        return queryset.prefetch_related(
+            Prefetch('products', queryset=Product.objects.filter(active=True).order_by('id'), to_attr='active_products')
+        )
+
     def get_products(self, obj):
         """Le paramètre 'obj' est l'instance de la catégorie consultée.
         Dans le cas d'une liste, cette méthode est appelée autant de fois qu'il y a d'entités dans la liste
         Show only products that are active"""
-        queryset = obj.products.filter(active=True)
+        # Use the products prefetched by the view, and only query them when the queryset was not prefetched
+        queryset = getattr(obj, 'active_products', None)
+        if queryset is None:
+            queryset = obj.products.filter(active=True).order_by('id')
         # The serializer is created with the queryset defined and always set as many=True
-        serializer = ProductListSerializer(queryset, many=True)
+        serializer = ProductListSerializer(queryset, many=True, context=self.context)
         # the '.data' property is the rendering of our serializer that we return here
         return serializer.data  # Calculate some data to return.
 
 
 class ProductListSerializer(serializers.ModelSerializer):
 
+    # The stored ecoscore is refreshed in the background by the refresh_ecoscores command
+    ecoscore = serializers.CharField(source='ecoscore_grade', read_only=True)
+
     class Meta:
         model = Product
-        fields = ['id', 'name', 'date_created', 'date_updated', 'category', 'ecoscore']
+        # The counters of the active articles are stored on the product, reading them costs no query
+        fields = ['id', 'name', 'date_created', 'date_updated', 'category', 'ecoscore', 'active_articles_count',
+                  'min_price']
 
 
 class ProductDetailSerializer(serializers.ModelSerializer):
@@ -83,13 +121,65 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         model = Product
         fields = ['id', 'name', 'date_created', 'date_updated', 'category', 'articles']
 
+    @staticmethod
+    def prefetch(queryset):
+        """Load the active articles of every product of the queryset with a single query"""
+        return queryset.prefetch_related(
+            Prefetch('articles', queryset=Article.objects.filter(active=True).order_by('id'), to_attr='active_articles')
+        )
+
     def get_articles(self, instance):
-        queryset = instance.articles.filter(active=True)
-        serializer = ArticleSerializer(queryset, many=True)
+        queryset = getattr(instance, 'active_articles', None)
+        if queryset is None:
+            queryset = instance.articles.filter(active=True).order_by('id')
+        serializer = ArticleSerializer(queryset, many=True, context=self.context)
         return serializer.data
 
 
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key relation looked up in the ``context_key`` dict of the serializer context (primary key -> instance)
+    when the view preloaded it, e.g. with ``in_bulk`` for a bulk payload, instead of one query per item.
+    """
+
+    def __init__(self, context_key, **kwargs):
+        self.context_key = context_key
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get(self.context_key)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = self.get_queryset().model._meta.pk.to_python(data)
+        except DjangoValidationError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return preloaded[pk]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+    @classmethod
+    def preload(cls, queryset, values):
+        """Return the dict to put in the context for the raw primary key ``values`` of a payload"""
+        to_python = queryset.model._meta.pk.to_python
+        pks = set()
+        for value in values:
+            try:
+                pks.add(to_python(value))
+            except DjangoValidationError:
+                # Reported by the field during the validation
+                pass
+        return queryset.in_bulk(pks)
+
+
 class ArticleSerializer(serializers.ModelSerializer):
+
+    # Bulk endpoints preload the products of the payload in the 'products' entry of the context
+    product = PreloadedPrimaryKeyRelatedField(context_key='products', queryset=Product.objects.all())
+
     class Meta:
         model = Article
         fields = ['id', 'date_created', 'date_updated', 'name', 'price', 'product']
@@ -105,3 +195,59 @@ class ArticleSerializer(serializers.ModelSerializer):
         if not value.active:
             raise serializers.ValidationError('The associated product must be active')
         return value
+
+
+class ValuesSerializer:
+    """
+    Read-only fast path for the list serializers. Rows are fetched with ``.values()`` on the columns the
+    model serializer needs, then formatted in a single loop, skipping the per field machinery of DRF.
+    The output is identical to the model serializer it is built from, which must only use plain model fields,
+    primary key relations, date times and decimals.
+    """
+
+    _instances = {}
+
+    def __init__(self, serializer_class):
+        self.fields = []
+        for name, field in serializer_class().fields.items():
+            if isinstance(field, serializers.SerializerMethodField):
+                raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} cannot be read with values()')
+            if isinstance(field, serializers.DateTimeField):
+                if getattr(field, 'format', api_settings.DATETIME_FORMAT).lower() != ISO_8601:
+                    raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} must be rendered as ISO 8601')
+                kind = 'datetime'
+            elif isinstance(field, serializers.DecimalField):
+                coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+                if not coerce_to_string or field.localize:
+                    raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} must be a plain decimal string')
+                kind = Decimal('.1') ** field.decimal_places
+            else:
+                kind = None
+            self.fields.append((name, field.source, kind))
+        self.sources = [source for name, source, kind in self.fields]
+
+    @classmethod
+    def for_serializer(cls, serializer_class):
+        # Introspecting the serializer fields is done once per serializer class
+        if serializer_class not in cls._instances:
+            cls._instances[serializer_class] = cls(serializer_class)
+        return cls._instances[serializer_class]
+
+    def to_representation(self, rows):
+        current_timezone = timezone.get_current_timezone()
+        fields = self.fields
+        data = []
+        for row in rows:
+            item = {}
+            for name, source, kind in fields:
+                value = row[source]
+                if value is not None and kind is not None:
+                    if kind == 'datetime':
+                        value = value.astimezone(current_timezone).isoformat()
+                        if value.endswith('+00:00'):
+                            value = value[:-6] + 'Z'
+                    else:
+                        value = '{:f}'.format(value.quantize(kind))
+                item[name] = value
+            data.append(item)
+        return data
@@ -0,0 +1,103 @@
+"""
+Keep the cached catalog responses in sync with the writes made through the models
+(admin viewsets, Django admin, shell...), as well as the counters of the categories and products.
+Bulk writes do not send signals and refresh the counters and invalidate the cache themselves.
+The query counter of shop/middleware.py and the SQLite profile of shop/database.py are installed here on every
+new database connection, and the triggers of the search index are created again after each migrate.
+"""
+from django.contrib.auth import get_user_model
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from shop.authentication import user_cache
+from shop.cache import response_cache
+from shop import database, search
+from shop.middleware import record_query
+from shop.models import Category, Product, Article, refresh_category_counters, refresh_product_counters
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    response_cache.invalidate('category', f'category:{instance.pk}')
+
+
+def counted_state_changed(instance, state, kwargs):
+    # Only creations, deletions and changes of the counted fields change the counters of the parents
+    return kwargs.get('created', True) or getattr(instance, '_loaded_counted', None) != state
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    # The category detail embeds its products
+    tags = {'product', f'product:{instance.pk}', f'category:{instance.category_id}'}
+    loaded_category_id = getattr(instance, '_loaded_category_id', None)
+    if loaded_category_id is not None:
+        tags.add(f'category:{loaded_category_id}')
+    if counted_state_changed(instance, (instance.category_id, instance.active), kwargs):
+        # With the category the product was counted in, if it moved since it was loaded or last saved
+        category_ids = {instance.category_id, getattr(instance, '_loaded_counted', (None, None))[0]} - {None}
+        refresh_category_counters(category_ids)
+        # The category list shows the counters
+        tags.update(['category', *(f'category:{pk}' for pk in category_ids)])
+        instance._loaded_counted = (instance.category_id, instance.active)
+    response_cache.invalidate(*tags)
+
+
+@receiver([post_save, post_delete], sender=Article)
+def invalidate_article(sender, instance, **kwargs):
+    # The product detail embeds its articles
+    tags = {'article', f'article:{instance.pk}', f'product:{instance.product_id}'}
+    loaded_product_id = getattr(instance, '_loaded_product_id', None)
+    if loaded_product_id is not None:
+        tags.add(f'product:{loaded_product_id}')
+    if counted_state_changed(instance, (instance.product_id, instance.active, instance.price), kwargs):
+        # With the product the article was counted in, if it moved since it was loaded or last saved
+        product_ids = {instance.product_id, getattr(instance, '_loaded_counted', (None, None, None))[0]} - {None}
+        refresh_product_counters(product_ids)
+        # The product list shows the counters, the category details embed the products
+        tags.add('product')
+        tags.update(f'category:{category_id}' for category_id in
+                    Product.objects.filter(id__in=product_ids).values_list('category_id', flat=True))
+        instance._loaded_counted = (instance.product_id, instance.active, instance.price)
+    response_cache.invalidate(*tags)
+
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def invalidate_user(sender, instance, **kwargs):
+    # Deactivated or demoted users must not be authenticated from the cache
+    user_cache.invalidate(instance.pk)
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    # First in the list: connection.execute_wrapper() pops the last wrapper when its block ends
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        database.apply_pragmas(connection.connection, database.get_pragmas())
+
+
+@receiver(request_started)
+def check_connections(sender, **kwargs):
+    # Connected after django's close_old_connections, which closes the connections older than CONN_MAX_AGE
+    if database.get_setting('HEALTH_CHECKS'):
+        for connection in connections.all():
+            database.check_connection(connection)
+
+
+@receiver(post_migrate)
+def create_search_triggers(sender, using, **kwargs):
+    # Django rebuilds a SQLite table to alter it, which drops the triggers keeping the search index in sync
+    if sender.name != 'shop' or not search.is_supported(connections[using]):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'shop_product_fts'")
+        if cursor.fetchone() is not None:
+            search.execute(cursor, search.CREATE_TRIGGERS)
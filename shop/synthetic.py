@@ -0,0 +1,63 @@
+"""
+Synthetic catalog used by the benchmark commands.
+Rows are inserted with bulk_create in batches, so that a catalog of a million articles takes seconds, not hours.
+"""
+import random
+from decimal import Decimal
+
+from shop.models import Category, Product, Article, refresh_category_counters, refresh_product_counters
+
+
+def batched_create(model, objects, batch_size):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def create_catalog(categories, products_per_category, articles_per_product, active_ratio=0.8,
+                   batch_size=5000, seed=None):
+    """
+    Create ``categories`` categories holding ``products_per_category`` products each,
+    every product holding ``articles_per_product`` articles.
+    About ``active_ratio`` of the rows of each level are active, it can also be a ratio per level
+    as a (categories, products, articles) tuple.
+    """
+    rng = random.Random(seed)
+    if isinstance(active_ratio, (tuple, list)):
+        category_ratio, product_ratio, article_ratio = active_ratio
+    else:
+        category_ratio = product_ratio = article_ratio = active_ratio
+    first_category_id = (Category.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+
+    batched_create(Category, (
+        # Named after their future id, names stay unique when the command is run again
+        Category(name=f'Category {index}', description=f'Category {index}', active=rng.random() < category_ratio)
+        for index in range(first_category_id, first_category_id + categories)
+    ), batch_size)
+    category_ids = list(Category.objects.filter(id__gte=first_category_id).order_by('id')
+                        .values_list('id', flat=True))
+
+    first_product_id = (Product.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    batched_create(Product, (
+        Product(name=f'Product {category_id}-{index}', category_id=category_id, active=rng.random() < product_ratio)
+        for category_id in category_ids
+        for index in range(products_per_category)
+    ), batch_size)
+    product_ids = list(Product.objects.filter(id__gte=first_product_id).order_by('id')
+                       .values_list('id', flat=True))
+
+    batched_create(Article, (
+        Article(name=f'Article {product_id}-{index}', product_id=product_id, active=rng.random() < article_ratio,
+                price=Decimal(rng.randint(100, 9999)) / 100)
+        for product_id in product_ids
+        for index in range(articles_per_product)
+    ), batch_size)
+    # bulk_create sends no signal, the counters of the new rows are computed once at the end
+    refresh_product_counters(Product.objects.filter(id__gte=first_product_id).values('id'))
+    refresh_category_counters(Category.objects.filter(id__gte=first_category_id).values('id'))
+    return len(category_ids)
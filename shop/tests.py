@@ -1,11 +1,54 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
 from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.test import AsyncClient, SimpleTestCase, TransactionTestCase, override_settings
 from django.urls import reverse_lazy, reverse
+from django.utils import timezone
+from django.utils.http import http_date
 from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from shop.authentication import user_cache
+from shop.cache import response_cache
+from shop.clients import HTTPClient, CircuitBreaker, CircuitOpenError, SingleFlight
+from shop.database import apply_pragmas, check_connection, get_pragmas
+from shop.ecoscore import ecoscore_cache, resolve_ecoscores, NOT_CACHED
+from shop.export import export_catalog
+from shop.importer import CatalogImporter, delete_catalog
+from shop.models import Category, Product, Article
+from shop.moderation import AhoCorasick, banned_words
+from shop.routers import PrimaryReplicaRouter, routing_state
+from shop.signals import create_search_triggers
+from shop.serializers import (CategoryDetailSerializer, CategoryListSerializer, ProductListSerializer,
+                              ArticleSerializer, ValuesSerializer)
+from shop.mocks import (mock_openfoodfact_success, mock_openfoodfact_failure, OpenFoodFactsStubServer,
+                        ECOSCORE_GRADE)
 
-from shop.models import Category, Product
-from shop.mocks import mock_openfoodfact_success, ECOSCORE_GRADE
+UserModel = get_user_model()
 
 
+# The tests run without DEBUG, the query headers are asserted on
+@override_settings(QUERY_COUNT_HEADERS=True)
 class ShopAPITestCase(APITestCase):
 
     @classmethod
@@ -17,17 +60,34 @@ class ShopAPITestCase(APITestCase):
         # Assigns the created category instance to a class attribute called category
         # Creates a new instance of the Category class with the name 'Fruits' and the active attribute set to True
         cls.category = Category.objects.create(name='Fruits', active=True)
-        # Creates a new instance of the Category class with the name 'Légumes' and the active attribute set to True
+        # Creates a new instance of the Category class with the name 'Légumes secs' and the active attribute set to False
         # This instance is not stored in a class attribute because it is not needed in subsequent tests
-        Category.objects.create(name='Légumes', active=False)
+        # (category names are unique)
+        Category.objects.create(name='Légumes secs', active=False)
 
         # Creates a new instance of the Product class with the name 'Ananas' and the active attribute set to True,
         # associated with the previously created category 'category'
-        cls.product = cls.category.products.create(name='Ananas', active=True)
+        cls.product = cls.category.products.create(name='Ananas', active=True, ecoscore_grade=ECOSCORE_GRADE)
         cls.category.products.create(name='Banane', active=False)
 
         cls.category_2 = Category.objects.create(name='Légumes', active=True)
-        cls.product_2 = cls.category_2.products.create(name='Tomate', active=True)
+        cls.product_2 = cls.category_2.products.create(name='Tomate', active=True, ecoscore_grade=ECOSCORE_GRADE)
+        # The counters (and date_updated) of the parents were refreshed in the database by the creations
+        for obj in (cls.category, cls.category_2):
+            obj.refresh_from_db()
+
+    def setUp(self):
+        # Cached values must not leak from one test to another
+        cache.clear()
+        ecoscore_cache.clear()
+
+    def assertQueryBudget(self, url, budget, method='get', **kwargs):
+        """Call the endpoint and fail if it issues more SQL queries than its budget"""
+        response = getattr(self.client, method)(url, **kwargs)
+        query_count = int(response['X-Query-Count'])
+        self.assertLessEqual(query_count, budget,
+                             f'{method.upper()} {url} issued {query_count} queries, its budget is {budget}')
+        return response
 
     def format_datetime(self, value):
         # Format DateTime Helper
@@ -41,6 +101,7 @@ class ShopAPITestCase(APITestCase):
                 'name': article.name,
                 'date_created': self.format_datetime(article.date_created),
                 'date_updated': self.format_datetime(article.date_updated),
+                'price': str(article.price),
                 'product': article.product_id
             } for article in articles
         ]
@@ -53,7 +114,9 @@ class ShopAPITestCase(APITestCase):
                 'date_created': self.format_datetime(product.date_created),
                 'date_updated': self.format_datetime(product.date_updated),
                 'category': product.category_id,
-                'ecoscore': ECOSCORE_GRADE  # the ecoscore value comes from our constant used in our mock
+                'ecoscore': product.ecoscore_grade,  # the ecoscore is stored by the refresh_ecoscores command
+                'active_articles_count': product.active_articles_count,
+                'min_price': None if product.min_price is None else str(product.min_price),
             } for product in products
         ]
 
@@ -64,7 +127,7 @@ class ShopAPITestCase(APITestCase):
                 'date_created': self.format_datetime(product.date_created),
                 'date_updated': self.format_datetime(product.date_updated),
                 'category': product.category_id,
-                'articles': self.get_article_list_data(product.articles.filter(active=True)),
+                'articles': self.get_article_list_data(product.articles.filter(active=True).order_by('id')),
             }
 
     def get_category_list_data(self, categories):
@@ -75,6 +138,7 @@ class ShopAPITestCase(APITestCase):
                 'date_created': self.format_datetime(category.date_created),
                 'date_updated': self.format_datetime(category.date_updated),
                 'description': category.description,
+                'active_products_count': category.active_products_count,
             } for category in categories
         ]
 
@@ -84,7 +148,7 @@ class ShopAPITestCase(APITestCase):
                 'name': category.name,
                 'date_created': self.format_datetime(category.date_created),
                 'date_updated': self.format_datetime(category.date_updated),
-                'products': self.get_product_list_data(category.products.filter(active=True))
+                'products': self.get_product_list_data(category.products.filter(active=True).order_by('id'))
             }
 
 
@@ -166,29 +230,1370 @@ class TestProduct(ShopAPITestCase):
         self.product.refresh_from_db()
 
 
+class TestEcoscoreCache(ShopAPITestCase):
+
+    url = reverse_lazy('product-list')
+
+    def test_list_makes_no_outbound_call(self):
+        # The product list reads the stored ecoscore
+        with mock.patch('shop.models.Product.call_external_api', autospec=True,
+                        side_effect=mock_openfoodfact_success) as api:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_product_list_data([self.product, self.product_2]), response.json()['results'])
+        self.assertEqual(api.call_count, 0)
+
+    def test_cached_lookup(self):
+        # Both products share the same barcode, the second lookup is served by the cache
+        with mock.patch('shop.models.Product.call_external_api', autospec=True,
+                        side_effect=mock_openfoodfact_success) as api:
+            self.assertEqual(self.product.ecoscore, ECOSCORE_GRADE)
+            self.assertEqual(self.product_2.ecoscore, ECOSCORE_GRADE)
+        self.assertEqual(api.call_count, 1)
+
+    def test_failure_is_cached(self):
+        with mock.patch('shop.models.Product.call_external_api', autospec=True,
+                        side_effect=mock_openfoodfact_failure) as api:
+            self.assertIsNone(self.product.ecoscore)
+            self.assertIsNone(self.product.ecoscore)
+        self.assertEqual(api.call_count, 1)
+
+    def test_invalidate(self):
+        with mock.patch('shop.models.Product.call_external_api', mock_openfoodfact_failure):
+            self.assertIsNone(self.product.ecoscore)
+        self.product.invalidate_ecoscore()
+        with mock.patch('shop.models.Product.call_external_api', mock_openfoodfact_success):
+            self.assertEqual(self.product.ecoscore, ECOSCORE_GRADE)
+
+
+class TestEcoscoreBatch(ShopAPITestCase):
+
+    def test_resolve_fetches_each_barcode_once(self):
+        with mock.patch('shop.models.Product.call_external_api', autospec=True,
+                        side_effect=mock_openfoodfact_success) as api:
+            ecoscores = resolve_ecoscores([self.product, self.product_2])
+        self.assertEqual(ecoscores, {self.product.barcode: ECOSCORE_GRADE})
+        self.assertEqual(api.call_count, 1)
+
+    def test_deadline(self):
+        # A hung upstream must not stall the batch: the ecoscore is returned empty once the deadline is reached
+        released = threading.Event()
+
+        def mock_openfoodfact_hung(product, method, url):
+            released.wait(5)
+            return mock_openfoodfact_failure(product, method, url)
+
+        with mock.patch('shop.models.Product.call_external_api', mock_openfoodfact_hung):
+            ecoscores = resolve_ecoscores([self.product, self.product_2], timeout=0.05)
+            released.set()
+            # Let the background fetch complete before the mock is removed
+            deadline = time.monotonic() + 5
+            while ecoscore_cache.get(self.product.barcode, NOT_CACHED) is NOT_CACHED and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(ecoscores, {self.product.barcode: None})
+
+    def test_refresh_command(self):
+        stale = self.category_2.products.create(name='Courgette', active=True, ecoscore_grade='a',
+                                                date_ecoscore_refreshed=timezone.now() - timedelta(days=30))
+        with mock.patch('shop.models.Product.call_external_api', mock_openfoodfact_success):
+            call_command('refresh_ecoscores', stdout=StringIO())
+        stale.refresh_from_db()
+        self.assertEqual(stale.ecoscore_grade, ECOSCORE_GRADE)
+        self.assertFalse(Product.objects.filter(date_ecoscore_refreshed__isnull=True).exists())
+
+    def test_refresh_command_calls_upstream(self):
+        # A cached grade or failure must not be taken for a fresh lookup
+        ecoscore_cache.set(self.product.barcode, 'e')
+        with mock.patch('shop.models.Product.call_external_api', autospec=True,
+                        side_effect=mock_openfoodfact_success) as api:
+            call_command('refresh_ecoscores', '--all', stdout=StringIO())
+        self.assertEqual(api.call_count, 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.ecoscore_grade, ECOSCORE_GRADE)
+        self.assertEqual(ecoscore_cache.get(self.product.barcode), ECOSCORE_GRADE)
+
+        ecoscore_cache.set(self.product.barcode, None)
+        with mock.patch('shop.models.Product.call_external_api', autospec=True,
+                        side_effect=mock_openfoodfact_success) as api:
+            call_command('refresh_ecoscores', '--all', stdout=StringIO())
+        self.assertEqual(api.call_count, 1)
+
+    def test_refresh_command_keeps_stale_value(self):
+        # Failed lookups keep serving the previous ecoscore and are retried on the next run
+        with mock.patch('shop.models.Product.call_external_api', mock_openfoodfact_failure):
+            call_command('refresh_ecoscores', stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.ecoscore_grade, ECOSCORE_GRADE)
+        self.assertIsNone(self.product.date_ecoscore_refreshed)
+
+
+class TestExternalAPIClient(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Each test gets its own client so that the circuit state does not leak
+        self.client_api = HTTPClient(retries=0, read_timeout=0.2, failure_threshold=2, reset_timeout=60)
+        patcher = mock.patch('shop.models.openfoodfacts_client', self.client_api)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stub_success(self):
+        with OpenFoodFactsStubServer() as server, override_settings(ECOSCORE={'URL': server.url}):
+            self.assertEqual(self.product.ecoscore, ECOSCORE_GRADE)
+        self.assertEqual(server.requests, ['/api/v0/product/%s.json' % self.product.barcode])
+        metrics = self.client_api.metrics()
+        self.assertEqual(metrics['calls'], 1)
+        self.assertEqual(metrics['state'], CircuitBreaker.CLOSED)
+
+    def test_circuit_opens(self):
+        with OpenFoodFactsStubServer(status=500) as server, override_settings(ECOSCORE={'URL': server.url}):
+            url = server.url.format(barcode=self.product.barcode)
+            self.client_api.request('GET', url)
+            self.client_api.request('GET', url)
+            # The upstream is not called anymore once the circuit is open
+            with self.assertRaises(CircuitOpenError):
+                self.client_api.request('GET', url)
+            self.assertIsNone(self.product.ecoscore)
+        self.assertEqual(len(server.requests), 2)
+        metrics = self.client_api.metrics()
+        self.assertEqual(metrics['state'], CircuitBreaker.OPEN)
+        self.assertEqual(metrics['rejected'], 2)
+
+    def test_unexpected_error_ends_the_trial(self):
+        # Half open, the trial call fails with an error the circuit does not record
+        self.client_api.breaker.opened_at = time.monotonic() - 60
+        with mock.patch.object(self.client_api.session, 'request', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client_api.request('GET', 'http://shop.test')
+        self.assertEqual(self.client_api.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.client_api.breaker.allow())
+
+    def test_late_call_does_not_end_the_trial(self):
+        # A call admitted while the circuit was closed finishes during the trial of the half open circuit
+        for outcome in (RuntimeError(), mock.Mock(status_code=500)):
+            with self.subTest(outcome=outcome):
+                breaker = self.client_api.breaker
+                breaker.reset()
+                started = {'late': threading.Event(), 'trial': threading.Event()}
+                released = {'late': threading.Event(), 'trial': threading.Event()}
+                results = {}
+
+                def request(method, url, **kwargs):
+                    name = url.rsplit('/', 1)[-1]
+                    started[name].set()
+                    released[name].wait(5)
+                    if name == 'late' and isinstance(outcome, Exception):
+                        raise outcome
+                    return outcome if name == 'late' else mock.Mock(status_code=200)
+
+                def call(name):
+                    try:
+                        results[name] = self.client_api.request('GET', f'http://shop.test/{name}')
+                    except RuntimeError as error:
+                        results[name] = error
+
+                with mock.patch.object(self.client_api.session, 'request', request):
+                    late = threading.Thread(target=call, args=('late',))
+                    late.start()
+                    started['late'].wait(5)
+                    breaker.opened_at = time.monotonic() - 60
+                    trial = threading.Thread(target=call, args=('trial',))
+                    trial.start()
+                    started['trial'].wait(5)
+                    released['late'].set()
+                    late.join()
+                    # The trial is still running, no other call is let through
+                    self.assertFalse(breaker.allow())
+                    released['trial'].set()
+                    trial.join()
+                self.assertEqual(results['trial'].status_code, 200)
+                self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_timeout(self):
+        with OpenFoodFactsStubServer(delay=0.5) as server, override_settings(ECOSCORE={'URL': server.url}):
+            self.assertIsNone(self.product.ecoscore)
+        self.assertEqual(self.client_api.metrics()['failures'], 1)
+
+
+class TestSingleFlight(ShopAPITestCase):
+
+    def test_concurrent_calls_are_coalesced(self):
+        released = threading.Event()
+        client_api = mock.Mock()
+
+        def request(method, url):
+            released.wait(5)
+            return mock_openfoodfact_success(None, method, url)
+
+        client_api.request.side_effect = request
+        flight = SingleFlight()
+        results = []
+        with mock.patch('shop.models.openfoodfacts_client', client_api), \
+                mock.patch('shop.models.openfoodfacts_flight', flight):
+            threads = [threading.Thread(target=lambda: results.append(self.product.fetch_ecoscore()))
+                       for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            # Let every thread join the call in flight before the upstream answers
+            deadline = time.monotonic() + 5
+            while flight.coalesced < 4 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            released.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(client_api.request.call_count, 1)
+        self.assertEqual(results, [ECOSCORE_GRADE] * 5)
+
+    def test_failed_call_is_forgotten(self):
+        flight = SingleFlight()
+        with self.assertRaises(CircuitOpenError):
+            flight.do('key', mock.Mock(side_effect=CircuitOpenError()))
+        # The failed call is forgotten, the next one runs again
+        self.assertEqual(flight.do('key', lambda: 'value'), 'value')
+
+
+class TestPrefetch(ShopAPITestCase):
+
+    def test_category_detail_query_count(self):
+        for index in range(5):
+            self.category.products.create(name=f'Produit {index}', active=True)
+        # Two queries for the validators, one for the category, one for all of its active products
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('category-detail', kwargs={'pk': self.category.pk}))
+        self.category.refresh_from_db()
+        self.assertEqual(response.json(), self.get_category_detail_data(self.category))
+
+    def test_product_detail_query_count(self):
+        for index in range(5):
+            self.product.articles.create(name=f'Article {index}', active=index % 2 == 0, price=2)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('product-detail', kwargs={'pk': self.product.pk}))
+        self.product.refresh_from_db()
+        self.assertEqual(response.json(), self.get_product_detail_data(self.product))
+
+    def test_serializers_without_prefetch(self):
+        # Serializers used outside of the viewsets still work, querying the children themselves
+        self.assertEqual(CategoryDetailSerializer(self.category).data['products'],
+                         self.get_product_list_data([self.product]))
+
+
+class TestQueryBudget(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Add some children, the budgets must not depend on their number
+        for index in range(5):
+            product = self.category.products.create(name=f'Produit {index}', active=True)
+            product.articles.create(name='Unité', active=True, price=2)
+            self.product.articles.create(name=f'Lot de {index}', active=True, price=3)
+
+    def test_public_endpoints(self):
+        # The validators of the conditional GET cost one query per list, two per detail
+        budgets = [
+            (reverse('category-list'), 3),
+            (reverse('category-detail', kwargs={'pk': self.category.pk}), 4),
+            (reverse('product-list'), 3),
+            (reverse('product-list') + '?category_id=%i' % self.category.pk, 3),
+            (reverse('product-detail', kwargs={'pk': self.product.pk}), 4),
+            (reverse('article-list'), 3),
+            (reverse('article-list') + '?product_id=%i' % self.product.pk, 3),
+        ]
+        for url, budget in budgets:
+            with self.subTest(url=url):
+                response = self.assertQueryBudget(url, budget)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('X-Query-Time-Ms', response)
+
+    @override_settings(QUERY_COUNT_HEADERS=False)
+    def test_headers_only_in_debug(self):
+        response = self.client.get(reverse('category-list'))
+        self.assertNotIn('X-Query-Count', response)
+        self.assertNotIn('X-Query-Time-Ms', response)
+
+    def test_admin_endpoints(self):
+        admin = UserModel.objects.create_superuser('admin', 'admin@shop.test', 'password', is_staff=True)
+        self.client.force_authenticate(admin)
+        budgets = [
+            (reverse('admin-category-list'), 2),
+            (reverse('admin-category-detail', kwargs={'pk': self.category.pk}), 2),
+            (reverse('admin-article-list'), 2),
+        ]
+        for url, budget in budgets:
+            with self.subTest(url=url):
+                self.assertEqual(self.assertQueryBudget(url, budget).status_code, 200)
+
+
+class TestKeysetPagination(ShopAPITestCase):
+
+    url = reverse_lazy('article-list')
+
+    def test_walk_pages(self):
+        articles = [self.product.articles.create(name=f'Article {index}', active=True, price=2) for index in range(15)]
+        # A single query per page (plus the validators), no COUNT(*)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'pagination': 'cursor'})
+        first_page = response.json()
+        self.assertNotIn('count', first_page)
+        self.assertIsNone(first_page['previous'])
+        self.assertEqual([article['id'] for article in first_page['results']], [article.id for article in articles[:10]])
+
+        with self.assertNumQueries(2):
+            second_page = self.client.get(first_page['next']).json()
+        self.assertEqual([article['id'] for article in second_page['results']],
+                         [article.id for article in articles[10:]])
+        self.assertIsNone(second_page['next'])
+
+    def test_default_pagination(self):
+        response = self.client.get(reverse('category-list'))
+        self.assertEqual(response.json()['count'], 2)
+
+
+class TestConditionalGet(ShopAPITestCase):
+
+    url = reverse_lazy('category-list')
+
+    def test_if_none_match(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        # Only the validators are computed, nothing is serialized
+        cache.clear()
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        # The validators are cached with the response, a cache hit needs no query at all
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalid_primary_key(self):
+        for name in ('category-detail', 'product-detail', 'article-detail'):
+            with self.subTest(name=name):
+                self.assertEqual(self.client.get(reverse(name, kwargs={'pk': 'abc'})).status_code, 404)
+
+    def test_if_modified_since(self):
+        url = reverse('category-detail', kwargs={'pk': self.category.pk})
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_has_no_last_modified(self):
+        # The latest date_updated of the remaining rows does not move when a row leaves the list
+        url = reverse('product-list')
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        Product.objects.filter(pk=self.product.pk).update(active=False)
+        cache.clear()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], self.get_product_list_data([self.product_2]))
+
+    def test_change_invalidates(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.disable()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], self.get_category_list_data([self.category_2]))
+
+    def test_detail_follows_children(self):
+        url = reverse('product-detail', kwargs={'pk': self.product.pk})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.articles.create(name='Unité', active=True, price=2)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_bulk_update_changes_date_updated(self):
+        date_updated = self.product.date_updated
+        self.category.disable()
+        self.product.refresh_from_db()
+        self.assertGreater(self.product.date_updated, date_updated)
+
+
+class TestResponseCache(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        response_cache.reset_stats()
+
+    def test_hit(self):
+        url = reverse('product-list')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(self.get_product_list_data([self.product, self.product_2]), response.json()['results'])
+        # Query parameters are part of the key
+        self.assertEqual(self.client.get(url, {'category_id': self.category.pk})['X-Cache'], 'MISS')
+        self.assertEqual(response_cache.stats(), {'hits': 1, 'misses': 2})
+
+    def test_admin_write_evicts_affected_entries(self):
+        admin = UserModel.objects.create_superuser('admin', 'admin@shop.test', 'password', is_staff=True)
+        article_url = reverse('article-list')
+        product_url = reverse('product-detail', kwargs={'pk': self.product.pk})
+        other_product_url = reverse('product-detail', kwargs={'pk': self.product_2.pk})
+        category_url = reverse('category-list')
+        for url in (article_url, product_url, other_product_url, category_url):
+            self.client.get(url)
+
+        self.client.force_authenticate(admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin-article-list'),
+                                        data={'name': 'Unité', 'price': '2.00', 'product': self.product.pk})
+        self.assertEqual(response.status_code, 201)
+        self.client.force_authenticate(None)
+
+        self.assertEqual(self.client.get(article_url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(product_url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(other_product_url)['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(category_url)['X-Cache'], 'HIT')
+
+    def test_disable_action_evicts(self):
+        admin = UserModel.objects.create_superuser('admin', 'admin@shop.test', 'password', is_staff=True)
+        url = reverse('product-list')
+        self.client.get(url)
+        self.client.force_authenticate(admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('category-disable', kwargs={'pk': self.category.pk}))
+        self.client.force_authenticate(None)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(self.get_product_list_data([self.product_2]), response.json()['results'])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                           'LOCATION': tempfile.mkdtemp()}})
+    def test_file_backend(self):
+        url = reverse('category-list')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.disable()
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_invalidated_on_commit(self):
+        # A response cached before the commit must not be kept under the new tokens
+        url = reverse('category-list')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.category.disable()
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_scheme_is_part_of_the_key(self):
+        # The pagination links are absolute
+        for index in range(10):
+            self.category.products.create(name=f'Produit {index}', active=True)
+        url = reverse('product-list')
+        self.client.get(url)
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(response.json()['next'].startswith('https://testserver/'))
+
+
+class TestFastList(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.product.articles.create(name='Unité', active=True, price='2.5')
+        self.product.articles.create(name='Lot de 3', active=True, price=7)
+        self.product_2.articles.create(name='Unité', active=True, price='0.99')
+        self.category.description = 'Fruits de saison'
+        self.category.save()
+
+    def test_parity(self):
+        for name in ('category-list', 'product-list', 'article-list'):
+            for params in ({}, {'pagination': 'cursor'}):
+                with self.subTest(url=name, params=params):
+                    expected = self.client.get(reverse(name), params).json()
+                    response = self.client.get(reverse(name), {'fast': 'true', **params})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.json()['results'], expected['results'])
+
+    def test_serializer_parity(self):
+        for serializer_class, queryset in ((CategoryListSerializer, Category.objects.order_by('id')),
+                                           (ProductListSerializer, Product.objects.order_by('id')),
+                                           (ArticleSerializer, Article.objects.order_by('id'))):
+            with self.subTest(serializer=serializer_class.__name__):
+                serializer = ValuesSerializer.for_serializer(serializer_class)
+                self.assertEqual(serializer.to_representation(queryset.values(*serializer.sources)),
+                                 [dict(item) for item in serializer_class(queryset, many=True).data])
+
+    def test_method_fields_are_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ValuesSerializer(CategoryDetailSerializer)
+
+
+class TestBulkArticles(ShopAPITestCase):
+
+    url = reverse_lazy('admin-article-bulk')
+
+    def setUp(self):
+        super().setUp()
+        self.inactive_product = self.category.products.get(name='Banane')
+        admin = UserModel.objects.create_superuser('admin', 'admin@shop.test', 'password', is_staff=True)
+        self.client.force_authenticate(admin)
+
+    def test_administrators_only(self):
+        user = UserModel.objects.create_user('user', 'user@shop.test', 'password')
+        payload = [{'name': 'Unité', 'price': '2.00', 'product': self.product.pk}]
+        for authenticated_user in (None, user):
+            self.client.force_authenticate(authenticated_user)
+            for method in ('post', 'patch', 'delete'):
+                with self.subTest(user=authenticated_user, method=method):
+                    response = getattr(self.client, method)(self.url, payload, format='json')
+                    self.assertIn(response.status_code, (401, 403))
+        self.assertFalse(Article.objects.exists())
+
+    def test_create(self):
+        payload = [{'name': f'Lot de {index}', 'price': '%i.50' % (index + 1),
+                    'product': self.product.pk if index % 2 else self.product_2.pk} for index in range(50)]
+        # Products are loaded with one query, the articles written with one INSERT and the product counters
+        # refreshed with one UPDATE
+        with self.assertNumQueries(5):
+            response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'created': 50})
+        self.assertEqual(self.product.articles.count(), 25)
+
+    def test_create_reports_errors_per_item(self):
+        payload = [
+            {'name': 'Unité', 'price': '2.00', 'product': self.product.pk},
+            {'name': 'Unité', 'price': '0.50', 'product': self.product.pk},
+            {'name': 'Unité', 'price': '2.00', 'product': self.inactive_product.pk},
+            {'name': 'Unité', 'price': '2.00', 'product': 0},
+        ]
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertEqual(list(errors[1]), ['price'])
+        self.assertEqual(errors[2], {'product': ['The associated product must be active']})
+        self.assertEqual(list(errors[3]), ['product'])
+        # Nothing is written when any item is invalid
+        self.assertFalse(Article.objects.exists())
+
+    def test_update(self):
+        articles = [self.product.articles.create(name='Unité', price=2) for _ in range(3)]
+        payload = [{'id': article.pk, 'price': '3.00'} for article in articles]
+        payload[0]['product'] = self.product_2.pk
+        response = self.client.patch(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'updated': 3})
+        self.assertEqual(set(Article.objects.values_list('price', flat=True)), {Decimal('3.00')})
+        self.assertEqual(self.product_2.articles.get().pk, articles[0].pk)
+
+    def test_update_unknown_article(self):
+        response = self.client.patch(self.url, [{'id': 0, 'price': '3.00'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), [{'id': ['Article not found.']}])
+
+    def test_delete(self):
+        articles = [self.product.articles.create(name='Unité', price=2) for _ in range(3)]
+        # Duplicated ids are deleted once
+        ids = [articles[0].pk, articles[1].pk, articles[0].pk]
+        response = self.client.delete(self.url, ids, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'deleted': 2})
+        self.assertEqual(list(Article.objects.all()), [articles[2]])
+
+    def test_payload_must_be_a_list(self):
+        response = self.client.post(self.url, {'name': 'Unité'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestCategoryUniqueNameMigration(SimpleTestCase):
+
+    make_unique_name = staticmethod(
+        import_module('shop.migrations.0004_category_unique_name').make_unique_name)
+
+    def test_suffix_fits(self):
+        name = 'a' * 255
+        unique_name = self.make_unique_name(name, 12, {name}, 255)
+        self.assertEqual(len(unique_name), 255)
+        self.assertEqual(unique_name, 'a' * 250 + ' (12)')
+
+    def test_collisions(self):
+        taken = {'Fruits', 'Fruits (3)', 'Fruits (3-2)'}
+        self.assertEqual(self.make_unique_name('Fruits', 3, taken, 255), 'Fruits (3-3)')
+
+
+class TestCascadeActivation(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.banane = self.category.products.get(name='Banane')
+        self.articles = [product.articles.create(name='Unité', active=product.active, price=2)
+                         for product in (self.product, self.banane, self.product_2)]
+
+    def test_disable_category(self):
+        # Three UPDATE statements and two for the counters, within a savepoint
+        with self.assertNumQueries(7):
+            counts = self.category.disable()
+        self.assertEqual(counts, {'categories': 1, 'products': 1, 'articles': 1})
+        self.assertFalse(Category.objects.get(pk=self.category.pk).active)
+        self.assertFalse(Product.objects.filter(category=self.category, active=True).exists())
+        self.assertFalse(Article.objects.filter(product__category=self.category, active=True).exists())
+        # The other category is untouched
+        self.assertTrue(Article.objects.get(pk=self.articles[2].pk).active)
+
+    def test_enable_category(self):
+        with self.assertNumQueries(7):
+            counts = self.category.enable()
+        self.assertEqual(counts, {'categories': 0, 'products': 1, 'articles': 1})
+        self.assertTrue(Article.objects.get(pk=self.articles[1].pk).active)
+
+    def test_disable_product(self):
+        counts = self.product.disable()
+        self.assertEqual(counts, {'categories': 0, 'products': 1, 'articles': 1})
+        self.assertFalse(Article.objects.get(pk=self.articles[0].pk).active)
+
+    def test_query_count_is_constant(self):
+        for index in range(20):
+            product = self.category.products.create(name=f'Produit {index}', active=True)
+            product.articles.create(name='Unité', active=True, price=2)
+        with self.assertNumQueries(7):
+            counts = self.category.disable()
+        self.assertEqual(counts, {'categories': 1, 'products': 21, 'articles': 21})
+
+    def test_bulk_activation(self):
+        admin = UserModel.objects.create_superuser('admin', 'admin@shop.test', 'password', is_staff=True)
+        self.client.force_authenticate(admin)
+        url = reverse('admin-category-activation')
+        response = self.client.post(url, {'ids': [self.category.pk, self.category_2.pk], 'active': False},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'updated': {'categories': 2, 'products': 2, 'articles': 2}})
+        self.assertFalse(Article.objects.filter(active=True).exists())
+        self.assertEqual(self.client.post(url, {'ids': [], 'active': True}, format='json').status_code, 400)
+
+
+class TestCatalogExport(ShopAPITestCase):
+
+    url = reverse_lazy('catalog-export')
+
+    def setUp(self):
+        super().setUp()
+        self.user = UserModel.objects.create_user('reader', 'reader@shop.test', 'password')
+        self.client.force_authenticate(self.user)
+        self.article = self.product.articles.create(name='Unité', active=True, price=2)
+        # Inactive product, its article is not exported
+        self.category.products.get(name='Banane').articles.create(name='Unité', active=True, price=2)
+
+    def get_lines(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_ndjson(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in self.get_lines(response)]
+        self.assertEqual([(record['type'], record['id']) for record in records], [
+            ('category', self.category.pk), ('category', self.category_2.pk),
+            ('product', self.product.pk), ('product', self.product_2.pk),
+            ('article', self.article.pk),
+        ])
+        self.assertEqual(records[-1]['product_id'], self.product.pk)
+        self.assertEqual(records[-1]['price'], '2.00')
+
+    def test_csv(self):
+        lines = self.get_lines(self.client.get(self.url, {'export_format': 'csv'}))
+        self.assertEqual(lines[0], 'type,id,category_id,category,product_id,product,name,description,price,active,'
+                                   'date_updated')
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[-1].startswith(f'article,{self.article.pk},,Fruits,{self.product.pk},Ananas,Unité,,2.00,'
+                                             'True,'))
+
+    def test_updated_since(self):
+        since = timezone.now()
+        Article.objects.filter(pk=self.article.pk).update(date_updated=since + timedelta(seconds=1))
+        lines = self.get_lines(self.client.get(self.url, {'updated_since': since.isoformat()}))
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.article.pk])
+        response = self.client.get(self.url, {'updated_since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_updated_since_includes_disabled_rows(self):
+        since = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.disable()
+        response = self.client.get(self.url, {'updated_since': since.isoformat()})
+        records = [json.loads(line) for line in self.get_lines(response)]
+        # The counters of the category changed too
+        self.assertEqual([(record['type'], record['id'], record['active']) for record in records], [
+            ('category', self.category.pk, True), ('product', self.product.pk, False),
+            ('article', self.article.pk, False),
+        ])
+
+    def test_one_query_per_model(self):
+        # Rows are fetched chunk by chunk from a single cursor per model while the response is streamed
+        for index in range(10):
+            self.product.articles.create(name=f'Lot de {index}', active=True, price=2)
+        with self.assertNumQueries(3):
+            lines = self.get_lines(self.client.get(self.url))
+        self.assertEqual(len(lines), 15)
+
+    def test_command(self):
+        stderr = StringIO()
+        with tempfile.NamedTemporaryFile(suffix='.csv') as output:
+            call_command('export_catalog', format='csv', output=output.name, stderr=stderr)
+            self.assertEqual(len(open(output.name, encoding='utf-8').read().splitlines()), 6)
+        self.assertIn('5 rows exported', stderr.getvalue())
+
+    def test_authentication_required(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+class TestCatalogImport(ShopAPITestCase):
+
+    def write_file(self, suffix, content):
+        file = tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8', delete=False)
+        with file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        return file.name
+
+    def write_jsonl(self, records):
+        return self.write_file('.jsonl', ''.join(json.dumps(record) + '\n' for record in records))
+
+    def import_catalog(self, *paths, **options):
+        output = StringIO()
+        call_command('import_catalog', *paths, stdout=output, **options)
+        return output.getvalue()
+
+    def test_import_jsonl(self):
+        path = self.write_jsonl([
+            {'type': 'category', 'name': 'Épicerie', 'active': True},
+            {'type': 'product', 'category': 'Épicerie', 'name': 'Sel', 'active': True},
+            {'type': 'article', 'category': 'Épicerie', 'product': 'Sel', 'name': '100g', 'price': '1.00'},
+            # Existing product, only its description changes
+            {'type': 'product', 'category': 'Fruits', 'name': 'Ananas', 'description': 'Victoria'},
+        ])
+        output = self.import_catalog(path)
+        self.assertIn('category: 1 created, 0 updated', output)
+        self.assertIn('product: 1 created, 1 updated', output)
+        self.assertIn('article: 1 created, 0 updated', output)
+        self.assertIn('rows/s', output)
+        article = Article.objects.get(product__name='Sel')
+        self.assertEqual((article.price, article.active), (Decimal('1.00'), False))
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.description, product.active), ('Victoria', True))
+        self.assertGreater(product.date_updated, self.product.date_updated)
+
+        # Importing the same file again changes nothing
+        output = self.import_catalog(path)
+        self.assertIn('product: 0 created, 0 updated', output)
+        self.assertEqual(Article.objects.count(), 1)
+
+    def test_import_csv(self):
+        path = self.write_file('.csv', 'type,category,product,name,price,active\n'
+                                       'article,Fruits,Ananas,Unité,2.50,true\n'
+                                       'article,Fruits,Ananas,Lot de 2,4.50,\n')
+        self.import_catalog(path)
+        self.assertEqual(list(self.product.articles.order_by('id').values_list('name', 'price', 'active')),
+                         [('Unité', Decimal('2.50'), True), ('Lot de 2', Decimal('4.50'), False)])
+
+    def test_export_can_be_imported(self):
+        self.product.articles.create(name='Unité', active=True, price=2)
+        export = self.write_file('.csv', ''.join(export_catalog('csv')))
+        self.import_catalog(export, replace=True)
+        self.assertEqual(list(Article.objects.values_list('product__category__name', 'product__name', 'name')),
+                         [('Fruits', 'Ananas', 'Unité')])
+        self.assertEqual(Category.objects.count(), 2)
+
+    def test_failed_replace_keeps_the_catalog(self):
+        path = self.write_jsonl([{'type': 'category', 'name': 'Épices'},
+                                 {'type': 'article', 'category': 'Épices', 'product': 'Poivre', 'name': 'Unité',
+                                  'price': '2.00'}])
+        with self.assertRaisesMessage(CommandError, "line 2: unknown product 'Épices / Poivre'"):
+            self.import_catalog(path, replace=True)
+        self.assertEqual(set(Category.objects.values_list('name', flat=True)), {'Fruits', 'Légumes', 'Légumes secs'})
+        self.assertTrue(Product.objects.filter(pk=self.product.pk).exists())
+
+    def test_duplicated_names_update_the_oldest_row(self):
+        # Only the category names are unique
+        duplicate = self.category.products.create(name=self.product.name, active=True)
+        path = self.write_jsonl([{'type': 'product', 'category': 'Fruits', 'name': self.product.name,
+                                  'description': 'Mûr'},
+                                 {'type': 'article', 'category': 'Fruits', 'product': self.product.name,
+                                  'name': 'Unité', 'price': '2.00'}])
+        self.import_catalog(path)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).description, 'Mûr')
+        self.assertNotEqual(Product.objects.get(pk=duplicate.pk).description, 'Mûr')
+        self.assertEqual(Article.objects.get(name='Unité').product_id, self.product.pk)
+
+    def test_queries_per_batch(self):
+        records = [{'type': 'article', 'category': 'Fruits', 'product': 'Ananas', 'name': f'Lot de {index}',
+                    'price': '2.00'} for index in range(100)]
+        # Parents, existing rows, one INSERT and the refresh of the product counters, within a savepoint
+        with self.assertNumQueries(6):
+            counts = CatalogImporter(batch_size=100).run(enumerate(records, start=1))
+        self.assertEqual(counts['article'], {'created': 100, 'updated': 0})
+
+    def test_errors(self):
+        path = self.write_jsonl([{'type': 'article', 'category': 'Fruits', 'product': 'Kiwi', 'name': 'Unité',
+                                  'price': '2.00'}])
+        with self.assertRaisesMessage(CommandError, "line 1: unknown product 'Fruits / Kiwi'"):
+            self.import_catalog(path)
+        path = self.write_jsonl([{'type': 'article', 'category': 'Fruits', 'product': 'Ananas', 'name': 'Unité',
+                                  'price': '1000'}])
+        with self.assertRaisesMessage(CommandError, 'line 1: price:'):
+            self.import_catalog(path)
+
+    def test_init_local_dev(self):
+        call_command('init_local_dev', stdout=StringIO())
+        self.assertFalse(Category.objects.filter(name='Fruits').exists())
+        self.assertEqual(Article.objects.filter(product__name='Banane').count(), 2)
+        self.assertEqual(Product.objects.get(name='Kiwi').articles.get(name='Unité').price, Decimal('0.75'))
+
+
+class TestBenchmarkCommands(ShopAPITestCase):
+
+    def test_generate_catalog(self):
+        call_command('generate_catalog', categories=3, products=4, articles=2, category_active_ratio=1,
+                     product_active_ratio=0, seed=0, replace=True, stdout=StringIO())
+        self.assertEqual(Category.objects.filter(active=True).count(), 3)
+        self.assertEqual(Product.objects.count(), 12)
+        self.assertFalse(Product.objects.filter(active=True).exists())
+        self.assertEqual(Article.objects.count(), 24)
+        # Generating again adds a catalog
+        call_command('generate_catalog', categories=3, products=1, articles=1, stdout=StringIO())
+        self.assertEqual(Category.objects.values('name').distinct().count(), 6)
+
+    def test_bench_endpoints(self):
+        self.product.articles.create(name='Unité', active=True, price=2)
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            call_command('bench_endpoints', requests=2, warmup=0, output=output, stdout=StringIO())
+            with open(output, encoding='utf-8') as file:
+                results = json.load(file)
+            self.assertEqual(results['endpoints']['product-detail']['status'], '200')
+            self.assertEqual(set(results['endpoints']['category-list']),
+                             {'method', 'url', 'status', 'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'queries',
+                              'throughput_rps'})
+            stdout = StringIO()
+            call_command('bench_endpoints', requests=2, warmup=0, compare=output, endpoints=['category-list'],
+                         stdout=stdout)
+            self.assertIn('Compared with the run of', stdout.getvalue())
+        # The benchmark user is rolled back
+        self.assertFalse(UserModel.objects.filter(username='benchmark').exists())
+
+
+class TestCachedAuthentication(ShopAPITestCase):
+
+    url = reverse_lazy('response-cache-metrics')
+
+    def setUp(self):
+        super().setUp()
+        self.user = UserModel.objects.create_superuser('admin', 'admin@shop.test', 'password')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def get(self):
+        response = self.client.get(self.url)
+        return response.status_code, int(response['X-Query-Count'])
+
+    def test_user_is_cached(self):
+        self.assertEqual(self.get(), (200, 1))
+        # The second request makes no query
+        self.assertEqual(self.get(), (200, 0))
+
+    def test_only_the_permission_fields_are_cached(self):
+        self.get()
+        key = user_cache.make_key(self.user.pk, user_cache.get_version(self.user.pk))
+        self.assertEqual(user_cache.backend.get(key),
+                         {'pk': self.user.pk, 'is_active': True, 'is_staff': True, 'is_superuser': True})
+
+    def test_saving_the_user_invalidates_it(self):
+        self.get()
+        self.user.is_superuser = False
+        self.user.save()
+        self.assertEqual(self.get(), (403, 1))
+
+    def test_inactive_and_deleted_users(self):
+        self.get()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get()[0], 401)
+        self.user.delete()
+        self.assertEqual(self.get()[0], 401)
+
+
+class TestAsyncViews(ShopAPITestCase):
+
+    def test_same_output_as_the_viewsets(self):
+        self.product.articles.create(name='Unité', active=True, price=2)
+        for url, params in (('category-list', {}), ('product-list', {}), ('product-list', {'category_id': 1}),
+                            ('article-list', {})):
+            response = self.client.get(reverse(f'async-{url}'), params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), self.client.get(reverse(url), params).json())
+
+    def test_pagination(self):
+        for index in range(12):
+            self.product.articles.create(name=f'Lot de {index}', active=True, price=2)
+        url = reverse('async-article-list')
+        response = self.client.get(url, {'page': 2, 'product_id': self.product.pk}).json()
+        self.assertEqual(response['count'], 12)
+        self.assertEqual(len(response['results']), 2)
+        self.assertIsNone(response['next'])
+        self.assertEqual(response['previous'], f'http://testserver{url}?product_id={self.product.pk}')
+        self.assertEqual(self.client.get(url, {'page': 3}).status_code, 404)
+
+    def test_invalid_filter(self):
+        response = self.client.get(reverse('async-article-list'), {'min_price': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), self.client.get(reverse('article-list'), {'min_price': 'abc'}).json())
+
+    def test_live_ecoscore(self):
+        # Products whose ecoscore is not stored yet are looked up
+        self.category.products.create(name='Kiwi', active=True, barcode='3017620422003')
+        with mock.patch('shop.models.Product.call_external_api', autospec=True,
+                        side_effect=mock_openfoodfact_success) as api:
+            response = self.client.get(reverse('async-product-list'))
+        self.assertEqual([product['ecoscore'] for product in response.json()['results']], [ECOSCORE_GRADE] * 3)
+        self.assertEqual(api.call_count, 1)
+
+    def test_concurrent_requests(self):
+        # The lookups of concurrent requests wait for the upstream together, not one after the other
+        categories = []
+        for index in range(3):
+            category = Category.objects.create(name=f'Catégorie {index}', active=True)
+            category.products.create(name='Kiwi', active=True, barcode=f'30176204220{index}')
+            categories.append(category)
+
+        async def get_pages():
+            client = AsyncClient()
+            return await asyncio.gather(*(client.get(reverse('async-product-list'), {'category_id': category.pk})
+                                          for category in categories))
+
+        with OpenFoodFactsStubServer(delay=0.3) as server, override_settings(ECOSCORE={'URL': server.url}):
+            start = time.perf_counter()
+            responses = async_to_sync(get_pages)()
+            duration = time.perf_counter() - start
+        self.assertEqual([response.json()['results'][0]['ecoscore'] for response in responses], [ECOSCORE_GRADE] * 3)
+        self.assertEqual(len(server.requests), 3)
+        self.assertLess(duration, 0.8)
+        # Count and page queries, counted per request by the async middleware
+        self.assertEqual([response['X-Query-Count'] for response in responses], ['2'] * 3)
+
+
+class TestCategoryModeration(ShopAPITestCase):
+
+    url = reverse_lazy('admin-category-list')
+
+    def setUp(self):
+        super().setUp()
+        banned_words.reset()
+        self.addCleanup(banned_words.reset)
+        admin = UserModel.objects.create_superuser('admin', 'admin@shop.test', 'password', is_staff=True)
+        self.client.force_authenticate(admin)
+
+    def create(self, name):
+        return self.client.post(self.url, {'name': name, 'description': f'Rayon {name}'}, format='json')
+
+    def test_matcher(self):
+        matcher = AhoCorasick(['spam', 'pamplemousse', 'am'])
+        self.assertEqual(matcher.search('antispam'), 'spam')
+        # 'am' ends before 'pamplemousse' does
+        self.assertEqual(matcher.search('pamplemousse'), 'am')
+        self.assertIsNone(matcher.search('fruits'))
+        # The cost does not depend on the number of words
+        matcher = AhoCorasick([f'mot{index}' for index in range(50000)])
+        self.assertEqual(matcher.search('un mot49999 interdit'), 'mot4')
+        self.assertIsNone(matcher.search('aucun'))
+
+    def test_banned_word(self):
+        response = self.create('Super SPAM')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'name': ['The name contains a forbidden word: spam']})
+
+    def test_file_is_reloaded(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'banned_words.txt')
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write('# commentaire\nbrocolis\n')
+            with override_settings(MODERATION={'BANNED_WORDS_FILE': path, 'CHECK_INTERVAL': 0}):
+                self.assertEqual(banned_words.search('Brocolis frais'), 'brocolis')
+                self.assertIsNone(banned_words.search('Spam'))
+                with open(path, 'w', encoding='utf-8') as file:
+                    file.write('spam\n')
+                os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+                self.assertIsNone(banned_words.search('Brocolis frais'))
+                self.assertEqual(banned_words.search('Spam'), 'spam')
+
+    def test_unique_name(self):
+        # No query to look for an existing category, the unique constraint refuses the INSERT within a savepoint
+        with self.assertNumQueries(4):
+            response = self.create('Fruits')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'name': ['Category already exists']})
+        self.assertEqual(self.create('Boissons').status_code, 201)
+        response = self.client.patch(reverse('admin-category-detail', args=[self.category_2.pk]),
+                                     {'name': 'Fruits', 'description': 'Fruits'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestSearch(ShopAPITestCase):
+
+    url = reverse_lazy('search')
+
+    def setUp(self):
+        super().setUp()
+        self.jus = self.category.products.create(name="Jus d'ananas", description='Pur jus', active=True)
+        self.article = self.product.articles.create(name='Ananas Victoria', active=True, price=3)
+        self.product.articles.create(name='Ananas en boîte', active=False, price=2)
+        self.product.refresh_from_db()
+
+    def search(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_ranked_and_active_only(self):
+        data = self.search(q='ananas')
+        # A match in the name ranks before a match in the description, inactive rows are left out
+        self.assertEqual([product['id'] for product in data['products']], [self.product.pk, self.jus.pk])
+        self.assertEqual(data['products'][0], self.get_product_list_data([self.product])[0])
+        self.assertEqual([article['id'] for article in data['articles']], [self.article.pk])
+
+    def test_prefix_and_accents(self):
+        self.assertEqual([product['id'] for product in self.search(q='TOMA', type='product')['products']],
+                         [self.product_2.pk])
+        pate = self.category_2.products.create(name='Pâté de campagne', active=True)
+        self.assertEqual(self.search(q='pate', type='product')['products'][0]['id'], pate.pk)
+        # FTS5 operators typed by the user are read as plain words
+        self.assertEqual(self.search(q='"jus*(', type='product')['products'][0]['id'], self.jus.pk)
+
+    def test_index_follows_writes(self):
+        Product.objects.filter(pk=self.jus.pk).update(name='Nectar de mangue')
+        self.assertEqual(self.search(q='nectar', type='product')['products'][0]['id'], self.jus.pk)
+        Product.objects.bulk_create([Product(name='Mangue', category=self.category, active=True)])
+        self.assertEqual(len(self.search(q='mangue', type='product')['products']), 2)
+        delete_catalog()
+        self.assertEqual(self.search(q='mangue'), {'products': [], 'articles': []})
+
+    def test_filters_of_the_lists(self):
+        data = self.search(q='ananas', type='product', category_id=self.category_2.pk)
+        self.assertEqual(data, {'products': []})
+
+    def test_invalid_parameters(self):
+        for params in ({}, {'q': 'ananas', 'type': 'category'}, {'q': 'ananas', 'limit': 0}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+    def test_triggers_are_created_again_after_migrate(self):
+        # Django rebuilds a SQLite table to alter it, which drops its triggers
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER shop_product_fts_insert')
+        create_search_triggers(sender=apps.get_app_config('shop'), using='default')
+        self.category.products.create(name='Mangue', active=True)
+        self.assertEqual(len(self.search(q='mangue', type='product')['products']), 1)
+
+
+class TestArticleFacets(ShopAPITestCase):
+
+    url = reverse_lazy('article-list')
+
+    def setUp(self):
+        super().setUp()
+        self.articles = [
+            self.product.articles.create(name='Unité', active=True, price='2.00'),
+            self.product.articles.create(name='Lot de 2', active=True, price='3.50'),
+            self.product_2.articles.create(name='Unité', active=True, price='1.20'),
+            self.product_2.articles.create(name='Cagette', active=False, price='9.00'),
+        ]
+
+    def get_ids(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [article['id'] for article in response.json()['results']]
+
+    def test_filters(self):
+        self.assertEqual(self.get_ids(min_price='2'), [self.articles[0].pk, self.articles[1].pk])
+        self.assertEqual(self.get_ids(max_price='2.00'), [self.articles[0].pk, self.articles[2].pk])
+        self.assertEqual(self.get_ids(category_id=self.category_2.pk), [self.articles[2].pk])
+        self.assertEqual(self.get_ids(category_id=self.category.pk, min_price='3', max_price='4'),
+                         [self.articles[1].pk])
+        response = self.client.get(self.url, {'min_price': 'deux'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('min_price', response.json())
+
+    def test_facets(self):
+        response = self.client.get(self.url, {'facets': 'true'})
+        self.assertEqual(response.json()['facets'], {
+            'price': {'min': '1.20', 'max': '3.50'},
+            'categories': [{'id': self.category.pk, 'count': 2}, {'id': self.category_2.pk, 'count': 1}],
+            'products': [
+                {'id': self.product.pk, 'category': self.category.pk, 'count': 2, 'min_price': '2.00',
+                 'max_price': '3.50'},
+                {'id': self.product_2.pk, 'category': self.category_2.pk, 'count': 1, 'min_price': '1.20',
+                 'max_price': '1.20'},
+            ],
+        })
+        # The facets follow the filters
+        response = self.client.get(self.url, {'facets': 'true', 'max_price': '1.50'})
+        self.assertEqual(response.json()['facets']['categories'], [{'id': self.category_2.pk, 'count': 1}])
+        self.assertNotIn('facets', self.client.get(self.url).json())
+
+    def test_query_count_is_fixed(self):
+        for index in range(30):
+            product = self.category.products.create(name=f'Produit {index}', active=True)
+            product.articles.create(name='Unité', active=True, price=index % 9 + 1)
+        # Two validators, count, page and one aggregated query per facet
+        with self.assertNumQueries(7):
+            response = self.client.get(self.url, {'facets': 'true', 'min_price': '1'})
+        self.assertEqual(len(response.json()['facets']['products']), 32)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        # The facets are cached with the page and invalidated when a product moves
+        self.assertEqual(self.client.get(self.url, {'facets': 'true', 'min_price': '1'})['X-Cache'], 'HIT')
+        self.product.category = self.category_2
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get(self.url, {'facets': 'true', 'min_price': '1'})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['facets']['categories'][1], {'id': self.category_2.pk, 'count': 3})
+
+
+class TestCounters(ShopAPITestCase):
+
+    def assertCounters(self, product, count, min_price):
+        product.refresh_from_db()
+        self.assertEqual((product.active_articles_count, product.min_price),
+                         (count, None if min_price is None else Decimal(min_price)))
+
+    def test_article_writes(self):
+        article = self.product.articles.create(name='Unité', active=True, price='2.50')
+        self.assertCounters(self.product, 1, '2.50')
+        cheap = self.product.articles.create(name='Promo', active=True, price='1.20')
+        self.product.articles.create(name='Cagette', active=False, price='1.00')
+        self.assertCounters(self.product, 2, '1.20')
+        # Moving an article changes both products
+        cheap.product = self.product_2
+        cheap.save()
+        self.assertCounters(self.product, 1, '2.50')
+        self.assertCounters(self.product_2, 1, '1.20')
+        article.price = Decimal('3.00')
+        article.save()
+        self.assertCounters(self.product, 1, '3.00')
+        article.delete()
+        self.assertCounters(self.product, 0, None)
+
+    def test_unchanged_counters_are_not_refreshed(self):
+        article = Article.objects.get(pk=self.product.articles.create(name='Unité', active=True, price=2).pk)
+        article.name = 'Unité de 1kg'
+        # The UPDATE of the article, the product is left alone
+        with self.assertNumQueries(1):
+            article.save()
 
+    def test_product_writes_and_cascades(self):
+        self.assertEqual(Category.objects.get(pk=self.category.pk).active_products_count, 1)
+        kiwi = self.category.products.create(name='Kiwi', active=True)
+        kiwi.articles.create(name='Unité', active=True, price=2)
+        self.assertEqual(Category.objects.get(pk=self.category.pk).active_products_count, 2)
+        kiwi.category = self.category_2
+        kiwi.save()
+        self.assertEqual(list(Category.objects.filter(pk__in=[self.category.pk, self.category_2.pk])
+                              .order_by('id').values_list('active_products_count', flat=True)), [1, 2])
 
+        self.category_2.disable()
+        self.assertEqual(Category.objects.get(pk=self.category_2.pk).active_products_count, 0)
+        self.assertCounters(kiwi, 0, None)
+        self.category_2.enable()
+        self.assertEqual(Category.objects.get(pk=self.category_2.pk).active_products_count, 2)
+        self.assertCounters(kiwi, 1, '2.00')
+        kiwi.disable()
+        self.assertEqual(Category.objects.get(pk=self.category_2.pk).active_products_count, 1)
+        kiwi.delete()
+        self.assertEqual(Category.objects.get(pk=self.category_2.pk).active_products_count, 1)
 
+    def test_bulk_endpoints(self):
+        admin = UserModel.objects.create_superuser('admin', 'admin@shop.test', 'password', is_staff=True)
+        self.client.force_authenticate(admin)
+        url = reverse('admin-article-bulk')
+        articles = [self.product.articles.create(name=f'Lot de {index}', active=True, price=index + 2)
+                    for index in range(3)]
+        self.assertCounters(self.product, 3, '2.00')
+        self.client.patch(url, [{'id': articles[0].pk, 'price': '9.00'}], format='json')
+        self.assertCounters(self.product, 3, '3.00')
+        self.client.delete(url, [articles[1].pk], format='json')
+        self.assertCounters(self.product, 2, '4.00')
+        # Articles created through the API are inactive
+        self.client.post(url, [{'name': 'Unité', 'price': '1.50', 'product': self.product.pk}], format='json')
+        self.assertCounters(self.product, 2, '4.00')
 
+    def test_lists(self):
+        self.product.articles.create(name='Unité', active=True, price='2.50')
+        self.client.get(reverse('product-list'))
+        # Validators, count and page: no query is added to read the counters, the fast path gives the same output
+        for params in ({}, {'fast': 'true'}):
+            response = self.client.get(reverse('product-list'), {'category_id': self.category.pk, **params})
+            self.assertEqual(response['X-Query-Count'], '3')
+            self.assertEqual(response.json()['results'][0]['active_articles_count'], 1)
+            self.assertEqual(response.json()['results'][0]['min_price'], '2.50')
+            response = self.client.get(reverse('category-list'), params)
+            self.assertEqual([category['active_products_count'] for category in response.json()['results']],
+                             [1, 1])
 
+    def test_reconcile_command(self):
+        self.product.articles.create(name='Unité', active=True, price='2.50')
+        # Raw writes send no signal, the counters drift
+        Article.objects.update(price='1.50')
+        Category.objects.filter(pk=self.category.pk).update(active_products_count=7)
+        with self.assertRaisesMessage(CommandError, '2 row(s) with drifted counters'):
+            call_command('reconcile_counters', check=True, stdout=StringIO())
 
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn(f'#{self.category.pk}: active_products_count 7 -> 1', out.getvalue())
+        self.assertIn(f'#{self.product.pk}: min_price 2.50 -> 1.50', out.getvalue())
+        self.assertCounters(self.product, 1, '1.50')
+        self.assertEqual(Category.objects.get(pk=self.category.pk).active_products_count, 1)
+        out = StringIO()
+        call_command('reconcile_counters', check=True, stdout=out)
+        self.assertIn('products: 0 drifted', out.getvalue())
 
 
+@override_settings(DATABASE_ROUTING={'REPLICAS': ['replica'], 'STICKY_SECONDS': 60})
+class TestDatabaseRouting(ShopAPITestCase):
 
+    def setUp(self):
+        super().setUp()
+        # The replica mirrors the primary test database (TEST['MIRROR'] in the settings). Its own connection would
+        # not see the rows written in the transaction of the test, it reads through the one of the primary instead
+        replica = connections['replica']
+        connections['replica'] = connections['default']
+        self.addCleanup(connections.__setitem__, 'replica', replica)
+        self.admin = UserModel.objects.create_superuser('admin', 'admin@shop.test', 'password', is_staff=True)
 
+    def test_catalog_reads_go_to_the_replica(self):
+        for url in (reverse('product-list'), reverse('category-detail', kwargs={'pk': self.category.pk}),
+                    reverse('async-article-list')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Read-Database'], 'replica')
+        self.assertEqual(self.client.get(reverse('product-list')).json()['results'],
+                         self.get_product_list_data(Product.objects.filter(active=True).order_by('id')))
 
+    def test_writes_and_admin_viewsets_use_the_primary(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse('admin-category-list'))
+        self.assertEqual(response['X-Read-Database'], 'default')
+        response = self.client.post(reverse('category-disable', kwargs={'pk': self.category_2.pk}))
+        self.assertEqual(response['X-Read-Database'], 'default')
+        self.assertFalse(Category.objects.using('default').get(pk=self.category_2.pk).active)
 
+    def test_read_your_writes(self):
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.get(reverse('category-list'))['X-Read-Database'], 'replica')
+        self.client.post(reverse('admin-category-list'), {'name': 'Épices', 'description': 'Épices'})
+        # The user who wrote reads from the primary for a while, the other clients keep reading the replica
+        self.assertEqual(self.client.get(reverse('category-list'))['X-Read-Database'], 'default')
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse('category-list'))['X-Read-Database'], 'replica')
+        self.client.force_authenticate(self.admin)
+        with override_settings(DATABASE_ROUTING={'REPLICAS': ['replica'], 'KEY_PREFIX': 'other'}):
+            self.assertEqual(self.client.get(reverse('category-list'))['X-Read-Database'], 'replica')
 
+    def test_replica_responses_are_not_cached(self):
+        url = reverse('category-list')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with override_settings(DATABASE_ROUTING={'REPLICAS': []}):
+            self.client.get(url)
+        # Filled from the primary, the entry is served to the replica readers until invalidated
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
 
+    def test_only_catalog_writes_are_sticky(self):
+        # Saving a session or the last login of a user does not change what the catalog reads
+        router = PrimaryReplicaRouter()
+        state = {'replica': None, 'wrote': False}
+        token = routing_state.set(state)
+        self.addCleanup(routing_state.reset, token)
+        for model in (Session, UserModel):
+            self.assertEqual(router.db_for_write(model), 'default')
+        self.assertFalse(state['wrote'])
+        router.db_for_write(Article)
+        self.assertTrue(state['wrote'])
 
+    def test_outside_of_a_request(self):
+        # Commands and shell use the primary
+        self.assertEqual(Category.objects.all().db, 'default')
+        self.assertEqual(Category.objects.db_manager().db, 'default')
 
 
+class TestSQLiteCommands(TransactionTestCase):
+    """The commands copying the database, out of a transaction the copy reads the committed rows of the primary"""
 
+    def test_sync_replica(self):
+        Category.objects.create(name='Fruits', active=True)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'db-replica.sqlite3')
+            call_command('sync_replica', output=path, stdout=StringIO())
+            with closing(sqlite3.connect(path)) as replica:
+                self.assertEqual(replica.execute('SELECT name, active_products_count FROM shop_category').fetchall(),
+                                 [('Fruits', 0)])
+        with self.assertRaisesMessage(CommandError, 'The replica is the primary database'):
+            call_command('sync_replica', stdout=StringIO())
 
+    def test_bench_sqlite(self):
+        category = Category.objects.create(name='Fruits', active=True)
+        category.products.create(name='Ananas', active=True).articles.create(name='Unité', active=True, price=2)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.json')
+            call_command('bench_sqlite', readers=2, writers=1, duration=0.2, output=path, stdout=StringIO())
+            with open(path, encoding='utf-8') as file:
+                results = json.load(file)
+        self.assertEqual(list(results['configurations']), ['default', 'profile', 'profile+persistent'])
+        for result in results['configurations'].values():
+            self.assertGreater(result['reads_per_second'], 0)
+            self.assertGreater(result['writes_per_second'], 0)
+        self.assertEqual(results['configurations']['profile+persistent']['pragmas']['journal_mode'], 'wal')
 
 
+class TestSQLiteProfile(ShopAPITestCase):
 
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'db.sqlite3')
 
+    def get_connection(self):
+        # A connection of its own to a database file, the test database lives in memory
+        default = connections['default']
+        wrapper = default.__class__({**default.settings_dict, 'NAME': self.path}, alias='profile')
+        self.addCleanup(wrapper.close)
+        return wrapper
 
+    def test_pragmas(self):
+        with closing(sqlite3.connect(self.path)) as sqlite_connection:
+            self.assertEqual(apply_pragmas(sqlite_connection, get_pragmas()), {
+                'journal_mode': 'wal',
+                'synchronous': 1,  # NORMAL
+                'cache_size': -64000,
+                'mmap_size': 128 * 1024 * 1024,
+                'busy_timeout': 5000,
+            })
+        with override_settings(SQLITE_PROFILE={'ENABLED': False}):
+            self.assertEqual(get_pragmas(), [])
+        with override_settings(SQLITE_PROFILE={'MMAP_SIZE': None}):
+            self.assertNotIn('mmap_size', dict(get_pragmas()))
 
+    def test_new_connections_are_configured(self):
+        wrapper = self.get_connection()
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone(), ('wal',))
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone(), (5000,))
 
+    def test_health_check(self):
+        wrapper = self.get_connection()
+        wrapper.ensure_connection()
+        check_connection(wrapper)
+        self.assertIsNotNone(wrapper.connection)
+        # A transaction left open by a previous request would keep the database locked
+        wrapper.connection.execute('BEGIN IMMEDIATE')
+        check_connection(wrapper)
+        self.assertIsNone(wrapper.connection)
@@ -1,16 +1,39 @@
-from django.http import JsonResponse
+import hashlib
+
+from asgiref.sync import sync_to_async
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import InvalidPage, Paginator
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date, quote_etag
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView
 from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.viewsets import ReadOnlyModelViewSet
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from shop.permissions import IsAdminAuthenticated, IsStaffAuthenticated
 
-from shop.models import Category, Product, Article
+from shop.cache import response_cache
+from shop.clients import openfoodfacts_client
+from shop.ecoscore import aresolve_ecoscores, get_setting as get_ecoscore_setting
+from shop.export import CONTENT_TYPES, FORMATS, export_catalog, parse_updated_since
+from shop.search import MAX_LIMIT, search
+from shop.models import Category, Product, Article, cascade_activation, refresh_product_counters
+from shop.pagination import KeysetPagination
+from shop.routers import current_replica, read_from_replica
 from shop.serializers import (CategoryListSerializer, CategoryDetailSerializer, ProductListSerializer,
-                              ProductDetailSerializer, ArticleSerializer)
+                              ProductDetailSerializer, ArticleSerializer, ValuesSerializer,
+                              PreloadedPrimaryKeyRelatedField, CategoryActivationSerializer)
 
 
 # class CategoryAPIView(APIView):
@@ -34,6 +57,17 @@ from shop.serializers import (CategoryListSerializer, CategoryDetailSerializer,
 #         return Category.objects.all()
 #
 
+class ReplicaReadMixin:
+    """Read the safe requests (list, detail...) from a replica, unless the user has just written (see shop/routers.py).
+    The other actions of the viewset, like the disable POST, use the primary."""
+
+    def initial(self, request, *args, **kwargs):
+        # After the authentication, the stickiness depends on the user
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            read_from_replica(request.user)
+
+
 class MultipleSerializerMixin:
     """Create and use a Mixin. This is to allow us to share the code which allows us to define the serializer
     to use according to the list and the details. This will avoid rewriting code and make maintenance easier."""
@@ -47,6 +81,157 @@ class MultipleSerializerMixin:
         return super().get_serializer_class()
 
 
+class KeysetPaginationMixin:
+    """Let a viewset, or a single request with ``?pagination=cursor``, use keyset pagination
+    instead of the default page number pagination."""
+
+    keyset_pagination = False
+
+    def use_keyset_pagination(self):
+        params = self.request.query_params
+        return self.keyset_pagination or params.get('pagination') == 'cursor' or 'cursor' in params
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.use_keyset_pagination():
+            self._paginator = KeysetPagination()
+        return super().paginator
+
+
+class FastListMixin:
+    """
+    Opt-in read-only fast path for the list action: with ``fast_list = True`` on the viewset,
+    or ``?fast=true`` on the request, rows are read with ``.values()`` and formatted by a ValuesSerializer
+    instead of going through the model serializer. The output is the same.
+    """
+
+    fast_list = False
+
+    def use_fast_list(self):
+        return self.fast_list or self.request.query_params.get('fast', '').lower() in ('1', 'true')
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_list():
+            return super().list(request, *args, **kwargs)
+        serializer = ValuesSerializer.for_serializer(self.get_serializer_class())
+        queryset = self.filter_queryset(self.get_queryset()).values(*serializer.sources)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(queryset))
+
+
+class ConditionalGetMixin:
+    """
+    Answer 304 Not Modified, without serializing anything, when the client already holds the current version.
+    The validators come from a single aggregate per queryset returned by ``get_validator_querysets``:
+    the latest ``date_updated`` and the number of rows, so that deletions change the ETag too.
+    Lists only send the ETag: a row leaving the list (disabled or deleted) does not move the latest ``date_updated``
+    of the remaining ones, a Last-Modified would answer 304 to ``If-Modified-Since`` for a list that changed.
+    """
+
+    def get_lookup_pk(self):
+        """Return the primary key of the detail request, or raise Http404 when the URL holds no valid primary key"""
+        value = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            return self.get_queryset().model._meta.pk.to_python(value)
+        except (TypeError, ValueError, DjangoValidationError):
+            # The validators are computed before get_object(), which would answer 404 too
+            raise Http404
+
+    def get_validator_querysets(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == 'retrieve':
+            queryset = queryset.filter(pk=self.get_lookup_pk())
+        return [queryset]
+
+    def get_validators(self):
+        last_modified = None
+        parts = [self.request.get_full_path(), self.request.accepted_renderer.format]
+        for queryset in self.get_validator_querysets():
+            aggregate = queryset.order_by().aggregate(last_modified=Max('date_updated'), count=Count('pk'))
+            parts.append(f"{aggregate['count']}:{aggregate['last_modified']}")
+            if aggregate['last_modified'] is not None:
+                last_modified = max(last_modified or aggregate['last_modified'], aggregate['last_modified'])
+        etag = quote_etag(hashlib.md5('|'.join(parts).encode()).hexdigest())
+        if self.action != 'retrieve' or last_modified is None:
+            return etag, None
+        # HTTP dates have a one second resolution
+        return etag, int(last_modified.timestamp())
+
+    def conditional_get(self, request, handler, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_get(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_get(request, super().retrieve, *args, **kwargs)
+
+
+class CachedResponseMixin:
+    """
+    Serve list and detail responses from the response cache. The key is made of the authentication scope,
+    the absolute url with its query parameters and the versions of the tags the response depends on:
+    the model name for lists, the object and the bulk writes of the model for details.
+    The ETag and Last-Modified headers are cached too, so that cache hits answer conditional requests.
+    Only the responses read from the primary are stored.
+    """
+
+    def get_cache_tags(self):
+        model_name = self.get_queryset().model._meta.model_name
+        if self.action == 'retrieve':
+            return [f"{model_name}:{self.kwargs['pk']}", f'{model_name}:bulk']
+        return [model_name]
+
+    def get_cache_scope(self):
+        user = self.request.user
+        if not user or not user.is_authenticated:
+            return 'anonymous'
+        return 'staff' if user.is_staff else 'authenticated'
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        params = sorted(request.query_params.lists())
+        url = f'{request.scheme}://{request.get_host()}{request.path}?{params}'
+        key = response_cache.make_key(self.get_cache_scope(), url, self.get_cache_tags())
+        cached = response_cache.get(key)
+        if cached is not None:
+            data, headers = cached
+            response = get_conditional_response(request, etag=headers.get('ETag'),
+                                                last_modified=headers.get('Last-Modified-Timestamp'))
+            if response is None:
+                response = Response(data)
+            for header in ('ETag', 'Last-Modified'):
+                if header in headers:
+                    response[header] = headers[header]
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = handler(request, *args, **kwargs)
+        # A replica may lag behind the invalidation, what it answered is not kept for the next clients
+        if response.status_code == 200 and current_replica() is None:
+            headers = {header: response[header] for header in ('ETag', 'Last-Modified') if header in response}
+            if 'Last-Modified' in response:
+                headers['Last-Modified-Timestamp'] = parse_http_date(response['Last-Modified'])
+            response_cache.set(key, (response.data, headers))
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+
 class AdminCategoryViewset(MultipleSerializerMixin, ModelViewSet):
     serializer_class = CategoryListSerializer
     detail_serializer_class = CategoryDetailSerializer
@@ -59,7 +244,19 @@ class AdminCategoryViewset(MultipleSerializerMixin, ModelViewSet):
     permission_classes = [IsAdminAuthenticated, IsStaffAuthenticated]
 
     def get_queryset(self):
-        return Category.objects.all()
+        queryset = Category.objects.all()
+        if self.action == 'retrieve':
+            queryset = CategoryDetailSerializer.prefetch(queryset)
+        return queryset
+
+    @action(detail=False, methods=['post'])
+    def activation(self, request):
+        """Enable or disable many categories at once, with their products and articles"""
+        serializer = CategoryActivationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        counts = cascade_activation(serializer.validated_data['active'],
+                                    category_ids=serializer.validated_data['ids'])
+        return Response({"updated": counts})
 
     # you can override the create method to prevent creation and add new categories
     # Une exception PermissionDenied est levée si un utilisateur tente de créer une nouvelle catégorie.
@@ -79,9 +276,120 @@ class AdminArticleViewset(ModelViewSet):
     serializer_class = ArticleSerializer
     queryset = Article.objects.all().order_by('id')
 
+    # Writes of the catalog, the bulk endpoints included, are reserved to administrators, as for the categories
+    permission_classes = [IsAdminAuthenticated, IsStaffAuthenticated]
+
+    # Bulk endpoints: maximum number of articles per request and per INSERT/UPDATE statement
+    bulk_max_items = 10000
+    bulk_batch_size = 500
+
+    def get_bulk_payload(self, request):
+        """Return the list sent to a bulk endpoint, or raise a ValidationError"""
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of articles.']})
+        if len(items) > self.bulk_max_items:
+            raise ValidationError({'non_field_errors': [f'At most {self.bulk_max_items} articles per request.']})
+        return items
+
+    def get_bulk_context(self, items):
+        # One query for all the products referenced by the payload instead of one per article
+        context = self.get_serializer_context()
+        context['products'] = PreloadedPrimaryKeyRelatedField.preload(
+            Product.objects.all(), [item['product'] for item in items if isinstance(item, dict) and 'product' in item]
+        )
+        return context
+
+    def invalidate_bulk(self, product_ids):
+        # Bulk writes send no signal, the product details embed their articles, the lists show the product counters
+        response_cache.invalidate('article', 'article:bulk', 'product', 'category:bulk',
+                                  *{f'product:{pk}' for pk in product_ids})
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Create a list of articles in a single transaction, or none of them if any is invalid"""
+        items = self.get_bulk_payload(request)
+        serializer = self.get_serializer(data=items, many=True, context=self.get_bulk_context(items))
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        articles = [Article(**data) for data in serializer.validated_data]
+        with transaction.atomic():
+            Article.objects.bulk_create(articles, batch_size=self.bulk_batch_size)
+            refresh_product_counters({article.product_id for article in articles})
+        self.invalidate_bulk({article.product_id for article in articles})
+        return Response({'created': len(articles)}, status=status.HTTP_201_CREATED)
+
+    @bulk.mapping.patch
+    def bulk_update(self, request):
+        """Partially update a list of articles identified by their 'id'"""
+        items = self.get_bulk_payload(request)
+        context = self.get_bulk_context(items)
+        articles = PreloadedPrimaryKeyRelatedField.preload(
+            Article.objects.all(), [item['id'] for item in items if isinstance(item, dict) and 'id' in item]
+        )
+
+        errors, updates = [], []
+        for item in items:
+            try:
+                article = articles.get(Article._meta.pk.to_python(item.get('id')))
+            except (AttributeError, DjangoValidationError):
+                article = None
+            if article is None:
+                errors.append({'id': ['Article not found.']})
+                continue
+            serializer = self.get_serializer(article, data=item, partial=True, context=context)
+            if serializer.is_valid():
+                errors.append({})
+                updates.append((article, serializer.validated_data))
+            else:
+                errors.append(serializer.errors)
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        fields = {'date_updated'}
+        product_ids = set()
+        for article, data in updates:
+            # Both the previous and the new product of a moved article change
+            product_ids.add(article.product_id)
+            for name, value in data.items():
+                setattr(article, name, value)
+                fields.add(name)
+            # bulk_update skips auto_now
+            article.date_updated = now
+            product_ids.add(article.product_id)
+        with transaction.atomic():
+            Article.objects.bulk_update([article for article, data in updates], fields,
+                                        batch_size=self.bulk_batch_size)
+            refresh_product_counters(product_ids)
+        self.invalidate_bulk(product_ids)
+        return Response({'updated': len(updates)})
+
+    @bulk.mapping.delete
+    def bulk_destroy(self, request):
+        """Delete a list of articles given by their ids"""
+        ids = self.get_bulk_payload(request)
+        if not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids):
+            raise ValidationError({'non_field_errors': ['Expected a list of article ids.']})
+        ids = sorted(set(ids))
+        table = connection.ops.quote_name(Article._meta.db_table)
+        deleted = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            product_ids = set(Article.objects.filter(id__in=ids).values_list('product_id', flat=True))
+            # Articles have no related rows to cascade: a bare DELETE, as delete_catalog does, without the per row
+            # signals of QuerySet.delete(). The counters and the cache are refreshed once for all the products below
+            for start in range(0, len(ids), self.bulk_batch_size):
+                chunk = ids[start:start + self.bulk_batch_size]
+                cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+                deleted += cursor.rowcount
+            refresh_product_counters(product_ids)
+        self.invalidate_bulk(product_ids)
+        return Response({'deleted': deleted})
+
 
 # transform ApiView into a ReadOnlyModelViewset
-class CategoryViewset(MultipleSerializerMixin, ReadOnlyModelViewSet):
+class CategoryViewset(ReplicaReadMixin, CachedResponseMixin, ConditionalGetMixin, FastListMixin,
+                      KeysetPaginationMixin, MultipleSerializerMixin, ReadOnlyModelViewSet):
     serializer_class = CategoryListSerializer
     # Let's add a class attribute that allows us to define our detail serialize
     detail_serializer_class = CategoryDetailSerializer
@@ -90,9 +398,20 @@ class CategoryViewset(MultipleSerializerMixin, ReadOnlyModelViewSet):
         # Apply a filter on only active categories
         # Le warning concernant la pagination peut être résolu en spécifiant un ordre explicite dans votre queryset :
         # Cela garantit que les résultats paginés sont renvoyés dans un ordre cohérent.
-        return Category.objects.filter(active=True).order_by('id')
+        queryset = Category.objects.filter(active=True).order_by('id')
+        if self.action == 'retrieve':
+            # The detail serializer reads the active products prefetched here instead of one query per category
+            queryset = CategoryDetailSerializer.prefetch(queryset)
+        return queryset
         # return Category.objects.all() # pour activer les categories via def enable il faut apply all categories
 
+    def get_validator_querysets(self):
+        querysets = super().get_validator_querysets()
+        if self.action == 'retrieve':
+            # The detail embeds the products of the category
+            querysets.append(Product.objects.filter(category_id=self.get_lookup_pk()))
+        return querysets
+
     # Create and use a Mixin instead
     # def get_serializer_class(self):
     #     # If the requested action is retrieve we return the detail serializer
@@ -103,18 +422,15 @@ class CategoryViewset(MultipleSerializerMixin, ReadOnlyModelViewSet):
     @action(detail=True, methods=['post'])  # We defined our accessible action on the POST method only
     # it concerns the detail because it allows you to deactivate a category
     def disable(self, request, pk):
-        # We can call the disable method
-        self.get_object().disable()
+        # We can call the disable method, it returns the number of rows changed per model
+        counts = self.get_object().disable()
         # Return a response (status_code=200 by default) to indicate the success of the action
-        return Response()
+        return Response({"status": "category and associated products and articles disabled", "updated": counts})
 
     @action(detail=True, methods=['post'])
     def enable(self, request, pk=None):
-        category = self.get_object()
-        # Debug
-        print(f"Enable action called for category ID: {pk}")
-        category.enable()
-        return Response({"status": "category and associated products enabled"})
+        counts = self.get_object().enable()
+        return Response({"status": "category and associated products and articles enabled", "updated": counts})
 
 
 # Function based view
@@ -136,7 +452,8 @@ class CategoryViewset(MultipleSerializerMixin, ReadOnlyModelViewSet):
 
 
 # transform ListAPIView into a ReadOnlyModelViewset
-class ProductViewset(MultipleSerializerMixin, ReadOnlyModelViewSet):
+class ProductViewset(ReplicaReadMixin, CachedResponseMixin, ConditionalGetMixin, FastListMixin,
+                     KeysetPaginationMixin, MultipleSerializerMixin, ReadOnlyModelViewSet):
     serializer_class = ProductListSerializer
     detail_serializer_class = ProductDetailSerializer
 
@@ -157,8 +474,17 @@ class ProductViewset(MultipleSerializerMixin, ReadOnlyModelViewSet):
         else:
             queryset = queryset.filter(active=True).order_by('id')
 
+        if self.action == 'retrieve':
+            queryset = ProductDetailSerializer.prefetch(queryset)
         return queryset
 
+    def get_validator_querysets(self):
+        querysets = super().get_validator_querysets()
+        if self.action == 'retrieve':
+            # The detail embeds the articles of the product
+            querysets.append(Article.objects.filter(product_id=self.get_lookup_pk()))
+        return querysets
+
     # Create and use a Mixin instead
     # def get_serializer_class(self):
     #     if self.action == 'retrieve':
@@ -167,16 +493,241 @@ class ProductViewset(MultipleSerializerMixin, ReadOnlyModelViewSet):
 
     @action(detail=True, methods=['post'])
     def disable(self, request, pk):
-        self.get_object().disable()
-        return Response({"status": "product and associated articles disabled"})
-
-
-class ArticleViewset(ReadOnlyModelViewSet):
+        counts = self.get_object().disable()
+        return Response({"status": "product and associated articles disabled", "updated": counts})
+
+
+class ArticleViewset(ReplicaReadMixin, CachedResponseMixin, ConditionalGetMixin, FastListMixin,
+                     KeysetPaginationMixin, ReadOnlyModelViewSet):
+    """
+    Active articles, filtered with ``product_id``, ``category_id``, ``min_price`` and ``max_price``.
+    With ``?facets=true`` the list also returns the facets of the filtered articles, computed with one aggregated
+    query each: the price range, the number of articles per category, and per product (the most represented
+    ``facet_products_limit`` ones, limited by the database) with their price range.
+    """
     serializer_class = ArticleSerializer
+    facet_products_limit = 50
+
+    def get_filter_param(self, name, field):
+        value = self.request.GET.get(name)
+        if not value:
+            return None
+        try:
+            return field.to_python(value)
+        except DjangoValidationError as error:
+            raise ValidationError({name: error.messages})
 
     def get_queryset(self):
-        queryset = Article.objects.filter(active=True)
-        product_id = self.request.GET.get('product_id')
-        if product_id:
+        queryset = Article.objects.filter(active=True).order_by('id')
+        product_id = self.get_filter_param('product_id', Product._meta.pk)
+        if product_id is not None:
             queryset = queryset.filter(product_id=product_id)
+        category_id = self.get_filter_param('category_id', Category._meta.pk)
+        if category_id is not None:
+            queryset = queryset.filter(product__category_id=category_id)
+        # Price ranges are served by the article_price_active_idx index
+        min_price = self.get_filter_param('min_price', Article._meta.get_field('price'))
+        if min_price is not None:
+            queryset = queryset.filter(price__gte=min_price)
+        max_price = self.get_filter_param('max_price', Article._meta.get_field('price'))
+        if max_price is not None:
+            queryset = queryset.filter(price__lte=max_price)
         return queryset
+
+    def use_facets(self):
+        return self.action == 'list' and self.request.GET.get('facets', '').lower() in ('1', 'true')
+
+    def get_cache_tags(self):
+        tags = super().get_cache_tags()
+        if self.use_facets():
+            # The facets group the articles by the category of their product, which may change
+            tags.append('product')
+        return tags
+
+    def get_validator_querysets(self):
+        querysets = super().get_validator_querysets()
+        if self.use_facets():
+            querysets.append(Product.objects.all())
+        return querysets
+
+    def get_facets(self, queryset):
+        # Aggregated, grouped, ordered and limited by the database: the cost does not grow with the rows in Python
+        price_field = self.get_serializer().fields['price']
+        queryset = queryset.order_by()
+        prices = queryset.aggregate(min_price=Min('price'), max_price=Max('price'))
+        categories = queryset.values('product__category_id').annotate(count=Count('id')).order_by(
+            '-count', 'product__category_id')
+        products = queryset.values('product_id', 'product__category_id').annotate(
+            count=Count('id'), min_price=Min('price'), max_price=Max('price')).order_by('-count', 'product_id')
+        return {
+            'price': {
+                'min': price_field.to_representation(prices['min_price']) if prices['min_price'] is not None else None,
+                'max': price_field.to_representation(prices['max_price']) if prices['max_price'] is not None else None,
+            },
+            'categories': [{'id': row['product__category_id'], 'count': row['count']} for row in categories],
+            'products': [{
+                'id': row['product_id'],
+                'category': row['product__category_id'],
+                'count': row['count'],
+                'min_price': price_field.to_representation(row['min_price']),
+                'max_price': price_field.to_representation(row['max_price']),
+            } for row in products[:self.facet_products_limit]],
+        }
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.use_facets():
+            response.data['facets'] = self.get_facets(self.filter_queryset(self.get_queryset()))
+        return response
+
+
+class ExternalAPIMetricsView(APIView):
+    """Circuit breaker state and call latency of the OpenFoodFacts client of this process."""
+
+    permission_classes = [IsAdminAuthenticated]
+
+    def get(self, request):
+        return Response(openfoodfacts_client.metrics())
+
+
+class ResponseCacheMetricsView(APIView):
+    """Hits and misses of the response cache in this process."""
+
+    permission_classes = [IsAdminAuthenticated]
+
+    def get(self, request):
+        return Response(response_cache.stats())
+
+
+class CatalogExportView(APIView):
+    """
+    Stream the whole active catalog in a single response, as NDJSON (default) or CSV with ``?export_format=csv``
+    (DRF reserves the ``format`` parameter for its renderers). ``?updated_since=<ISO 8601 date>`` only exports
+    the rows changed since then, the disabled ones included (see shop/export.py for the deleted ones).
+    The rows are read chunk by chunk, the memory used does not depend on the catalog size.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        export_format = request.GET.get('export_format', 'ndjson')
+        if export_format not in FORMATS:
+            raise ValidationError({'export_format': [f'Expected one of {", ".join(FORMATS)}.']})
+        updated_since = request.GET.get('updated_since')
+        if updated_since is not None:
+            updated_since = parse_updated_since(updated_since)
+            if updated_since is None:
+                raise ValidationError({'updated_since': ['Expected an ISO 8601 date or date time.']})
+
+        response = StreamingHttpResponse(export_catalog(export_format, updated_since),
+                                         content_type=CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = f'attachment; filename="catalog.{export_format}"'
+        return response
+
+
+class SearchView(APIView):
+    """
+    Full-text search of the products and articles on their name and description (see shop/search.py),
+    best matches first: ``/api/search/?q=jus d'orange``. ``type=product`` or ``type=article`` restricts the search,
+    ``limit`` (20 by default) is the number of results per type. Only the rows the product and article lists show
+    are returned, their filters (``category_id``, ``product_id``) can be added to the query string.
+    """
+
+    viewsets = {
+        'product': ProductViewset,
+        'article': ArticleViewset,
+    }
+
+    def get(self, request):
+        query = request.GET.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': ['This parameter is required.']})
+        kinds = request.GET.get('type')
+        kinds = list(self.viewsets) if kinds is None else kinds.split(',')
+        if not kinds or set(kinds) - set(self.viewsets):
+            raise ValidationError({'type': [f'Expected {" or ".join(self.viewsets)}.']})
+        try:
+            limit = int(request.GET.get('limit', 20))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= MAX_LIMIT:
+            raise ValidationError({'limit': [f'Expected a number between 1 and {MAX_LIMIT}.']})
+
+        data = {}
+        for kind in kinds:
+            # The viewset builds the queryset, so that the search shows the same rows as the list
+            view = self.viewsets[kind]()
+            view.action = 'list'
+            view.request = request
+            view.kwargs = {}
+            queryset = view.get_queryset()
+            ids = search(queryset, query, limit)
+            serializer = ValuesSerializer.for_serializer(view.get_serializer_class())
+            rows = {row['id']: row for row in queryset.filter(id__in=ids).values(*serializer.sources)}
+            data[f'{kind}s'] = serializer.to_representation(rows[pk] for pk in ids)
+        return Response(data)
+
+
+# Async versions of the catalog lists, for ASGI servers (uvicorn project.asgi:application...).
+# DRF views are synchronous, these plain Django views return the same page as the page-number pagination of the
+# viewsets, read with the values() fast path. The ORM is synchronous too and is called through sync_to_async,
+# while the ecoscore lookups of a page are awaited together: a worker keeps serving other requests meanwhile.
+
+def get_values_page(queryset, sources, number):
+    """Return the count of the queryset and the rows of the page ``number``"""
+    paginator = Paginator(queryset.values(*sources), api_settings.PAGE_SIZE)
+    page = paginator.page(number)
+    return paginator.count, page.number, page.has_next(), list(page.object_list)
+
+
+async def async_list(request, viewset_class, live_ecoscore=False):
+    # The viewset builds the queryset, so that both versions apply the same filters
+    view = viewset_class()
+    view.action = 'list'
+    view.request = request
+    view.kwargs = {}
+    serializer = ValuesSerializer.for_serializer(view.get_serializer_class())
+    sources = serializer.sources + ['barcode'] if live_ecoscore else serializer.sources
+    # Like the viewsets, read from a replica unless the user has just written (the session user is read in a thread)
+    await sync_to_async(read_from_replica)(request.user)
+
+    try:
+        count, number, has_next, rows = await sync_to_async(get_values_page)(
+            view.get_queryset(), sources, request.GET.get('page', 1))
+    except InvalidPage:
+        return JsonResponse({'detail': 'Invalid page.'}, status=404)
+    except ValidationError as error:
+        # Invalid filters (?min_price=abc), DRF's exception handler does not run for these views
+        return JsonResponse(error.detail, status=400, safe=False)
+
+    if live_ecoscore:
+        # Products whose ecoscore is not stored yet are looked up concurrently, within the page deadline
+        missing = [Product(barcode=row['barcode']) for row in rows
+                   if row['ecoscore_grade'] is None and row['barcode']]
+        ecoscores = await aresolve_ecoscores(missing, timeout=get_ecoscore_setting('PAGE_TIMEOUT'))
+        for row in rows:
+            if row['ecoscore_grade'] is None:
+                row['ecoscore_grade'] = ecoscores.get(row['barcode'])
+
+    url = request.build_absolute_uri()
+    previous_url = None
+    if number > 1:
+        previous_url = replace_query_param(url, 'page', number - 1) if number > 2 else remove_query_param(url, 'page')
+    return JsonResponse({
+        'count': count,
+        'next': replace_query_param(url, 'page', number + 1) if has_next else None,
+        'previous': previous_url,
+        'results': serializer.to_representation(rows),
+    })
+
+
+async def async_category_list(request):
+    return await async_list(request, CategoryViewset)
+
+
+async def async_product_list(request):
+    return await async_list(request, ProductViewset, live_ecoscore=True)
+
+
+async def async_article_list(request):
+    return await async_list(request, ArticleViewset)